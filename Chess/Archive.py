@@ -0,0 +1,347 @@
+# Compact binary game archive with an on-disk index from position key to the games reaching it.
+# An archive is an 8 byte header followed by one record per game (little endian):
+#   flags (1 byte: bit 0 set when the game does not start from the start position), result (1 byte),
+#   ply count (2 bytes), then for a set-up start its packed state (GameState.get_packed_state, 66 bytes) with the
+#   half and full move counters (2 bytes each), then one 2 byte move index per ply.
+# A move index is the move's position among the legal moves sorted by moveID, so it does not depend on the
+# order a backend generates moves in. Decoding replays the moves.
+# The index (archive path + '.idx') is an 8 byte header followed by 16 byte (position key, record offset)
+# entries sorted by key, one per distinct position of each game. It is memory mapped and binary searched, so a
+# lookup reads a few dozen entries whatever the size of the archive. ArchiveWriter builds it as games are written,
+# sorting runs of entries in memory and merging them from temporary files, so millions of games fit.
+# Run with: python -m Chess.Archive show ARCHIVE [--limit N] | find ARCHIVE FEN | index ARCHIVE
+
+import argparse
+import heapq
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from operator import attrgetter
+
+from Chess.Backends import BACKENDS
+from Chess.ChessEngine import GameState
+from Chess.PGN import format_game, san
+
+ARCHIVE_MAGIC = b'CHGA\x01\x00\x00\x00'
+# version 2: position keys only include the en passant file when the capture is possible
+INDEX_MAGIC = b'CHGI\x02\x00\x00\x00'
+HEADER_BYTES = 8
+RECORD = struct.Struct('<BBH')
+COUNTERS = struct.Struct('<HH')
+PACKED_BYTES = 66
+ENTRY = struct.Struct('<QQ')
+ENTRY_BYTES = ENTRY.size
+KEY = struct.Struct('<Q')
+SET_UP = 1
+
+RESULTS = ('*', '1-0', '0-1', '1/2-1/2')
+RESULT_CODES = {result: code for code, result in enumerate(RESULTS)}
+START_PACKED = GameState().get_packed_state()
+# index entries sorted in memory before a run is spilled to a temporary file
+RUN_ENTRIES = 1 << 20
+# bytes read from a run file at a time while merging
+MERGE_BUFFER = 1 << 16
+
+move_order = attrgetter('moveID')
+
+
+class ArchivedGame:
+    __slots__ = ('offset', 'result', 'start', 'halfmove_clock', 'fullmove_number', 'moves')
+
+    def __init__(self, offset, result, start, halfmove_clock, fullmove_number, moves):
+        self.offset = offset
+        self.result = result
+        # packed start position
+        self.start = start
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+        # array('H') of move indexes
+        self.moves = moves
+
+    def __repr__(self):
+        return "ArchivedGame(offset=%d, result=%r, plies=%d)" % (self.offset, self.result, len(self.moves))
+
+
+# Record bytes and the distinct position keys of the game's moveLog, from its first position on.
+# The moves are undone to reach the start and made again, so the game ends up as it was
+def encode_game(game, result='*'):
+    played = list(game.moveLog)
+    for _ in played:
+        game.undo_move()
+    start = game.get_packed_state()
+    halfmove_clock, fullmove_number = game.get_halfmove_clock(), game.get_fullmove_number()
+    indexes = array('H')
+    keys = {game.position_key}
+    for move in played:
+        ids = sorted(legal.moveID for legal in game.get_valid_moves())
+        indexes.append(ids.index(move.moveID))
+        game.make_move(move)
+        keys.add(game.position_key)
+
+    if sys.byteorder != 'little':
+        indexes.byteswap()
+    set_up = start != START_PACKED or halfmove_clock != 0 or fullmove_number != 1
+    data = RECORD.pack(SET_UP if set_up else 0, RESULT_CODES[result], len(played))
+    if set_up:
+        data += start + COUNTERS.pack(halfmove_clock, fullmove_number)
+    return data + indexes.tobytes(), keys
+
+
+# Set game up at the archived game's start and play its moves (or the first plies of them)
+def replay(record, game, plies=None):
+    game.load_packed_state(record.start)
+    game.set_move_counters(record.halfmove_clock, record.fullmove_number)
+    for index in record.moves[:plies]:
+        game.make_move(sorted(game.get_valid_moves(), key=move_order)[index])
+    return game
+
+
+# Sorts and writes (key, offset) index entries, spilling sorted runs to temporary files when there are many
+class _IndexBuilder:
+    def __init__(self, path, run_entries=RUN_ENTRIES):
+        self.path = path
+        self.run_entries = run_entries
+        # key << 64 | offset, so a plain sort orders by key and then offset
+        self.entries = []
+        self.runs = []
+
+    def add(self, keys, offset):
+        self.entries.extend(key << 64 | offset for key in keys)
+        if len(self.entries) >= self.run_entries:
+            self.spill()
+
+    def spill(self):
+        self.entries.sort()
+        run = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(self.path)))
+        run.write(_pack_entries(self.entries))
+        run.seek(0)
+        self.runs.append(run)
+        self.entries = []
+
+    def finish(self):
+        self.entries.sort()
+        merged = heapq.merge(*[_read_run(run) for run in self.runs], self.entries)
+        with open(self.path, 'wb') as file:
+            file.write(INDEX_MAGIC)
+            chunk = []
+            for entry in merged:
+                chunk.append(entry)
+                if len(chunk) >= MERGE_BUFFER:
+                    file.write(_pack_entries(chunk))
+                    chunk = []
+            file.write(_pack_entries(chunk))
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.entries = []
+
+
+def _pack_entries(entries):
+    mask = (1 << 64) - 1
+    return b''.join([ENTRY.pack(entry >> 64, entry & mask) for entry in entries])
+
+
+def _read_run(run):
+    while True:
+        data = run.read(MERGE_BUFFER * ENTRY_BYTES)
+        if not data:
+            break
+        for key, offset in ENTRY.iter_unpack(data):
+            yield key << 64 | offset
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+# Writes games to a new archive and, on close, their index
+class ArchiveWriter:
+    def __init__(self, path, index=True, run_entries=RUN_ENTRIES):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(ARCHIVE_MAGIC)
+        self.offset = HEADER_BYTES
+        self.count = 0
+        self.index = _IndexBuilder(index_path(path), run_entries) if index else None
+
+    # Append the game's moveLog with its result ('1-0', '0-1', '1/2-1/2' or '*'); returns the record's offset
+    def write(self, game, result='*'):
+        data, keys = encode_game(game, result)
+        return self.write_record(data, keys)
+
+    # Append an already encoded record (from encode_game, e.g. done in a worker process)
+    def write_record(self, data, keys):
+        offset = self.offset
+        self.file.write(data)
+        self.offset += len(data)
+        self.count += 1
+        if self.index is not None:
+            self.index.add(keys, offset)
+        return offset
+
+    def close(self):
+        self.file.close()
+        if self.index is not None:
+            self.index.finish()
+            self.index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchiveReader:
+    # use_index=False leaves any index alone, e.g. to rebuild one from an older version
+    def __init__(self, path, use_index=True):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.size = self.file.seek(0, 2)
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:HEADER_BYTES] != ARCHIVE_MAGIC:
+            self.close()
+            raise ValueError("%s is not a game archive" % path)
+        self.index_file = None
+        self.index = None
+        self.entries = 0
+        if use_index and os.path.exists(index_path(path)):
+            self.index_file = open(index_path(path), 'rb')
+            self.index = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.index[:HEADER_BYTES] != INDEX_MAGIC:
+                self.close()
+                raise ValueError("%s is not a game archive index of this version; rebuild it with build_index"
+                                 % index_path(path))
+            self.entries = (len(self.index) - HEADER_BYTES) // ENTRY_BYTES
+
+    def close(self):
+        for handle in (self.index, self.index_file, self.data, self.file):
+            if handle is not None:
+                handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # The record at offset and the offset of the next one
+    def read(self, offset):
+        flags, result, plies = RECORD.unpack_from(self.data, offset)
+        position = offset + RECORD.size
+        start, halfmove_clock, fullmove_number = START_PACKED, 0, 1
+        if flags & SET_UP:
+            start = self.data[position:position + PACKED_BYTES]
+            halfmove_clock, fullmove_number = COUNTERS.unpack_from(self.data, position + PACKED_BYTES)
+            position += PACKED_BYTES + COUNTERS.size
+        moves = array('H', self.data[position:position + 2 * plies])
+        if sys.byteorder != 'little':
+            moves.byteswap()
+        return ArchivedGame(offset, RESULTS[result], start, halfmove_clock, fullmove_number, moves), \
+            position + 2 * plies
+
+    # Every record in file order, without replaying anything
+    def __iter__(self):
+        offset = HEADER_BYTES
+        while offset < self.size:
+            record, offset = self.read(offset)
+            yield record
+
+    # Index of the first index entry with this key (or a larger one)
+    def lower_bound(self, key):
+        low, high = 0, self.entries
+        index = self.index
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(index, HEADER_BYTES + middle * ENTRY_BYTES)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Offsets of the games that reach the position with this key, in file order
+    def find(self, key):
+        if self.index is None:
+            raise ValueError("%s has no index; build it with build_index" % self.path)
+        offsets = []
+        entry = self.lower_bound(key)
+        while entry < self.entries:
+            entry_key, offset = ENTRY.unpack_from(self.index, HEADER_BYTES + entry * ENTRY_BYTES)
+            if entry_key != key:
+                break
+            offsets.append(offset)
+            entry += 1
+        return offsets
+
+    # The archived games reaching the game's current position
+    def games_reaching(self, game):
+        return [self.read(offset)[0] for offset in self.find(game.position_key)]
+
+
+# (Re)build the index of an existing archive by replaying every game
+def build_index(path, backend='bitboard', run_entries=RUN_ENTRIES):
+    builder = _IndexBuilder(index_path(path), run_entries)
+    game = BACKENDS[backend]()
+    with ArchiveReader(path, use_index=False) as reader:
+        for record in reader:
+            replay(record, game, 0)
+            keys = {game.position_key}
+            for index in record.moves:
+                game.make_move(sorted(game.get_valid_moves(), key=move_order)[index])
+                keys.add(game.position_key)
+            builder.add(keys, record.offset)
+    builder.finish()
+
+
+# PGN text of an archived game
+def to_pgn(record, game, headers=()):
+    replay(record, game, 0)
+    black_first = not game.whiteToMove
+    first_move_number = game.get_fullmove_number()
+    headers = list(headers) + [('Result', record.result)]
+    if record.start != START_PACKED or record.halfmove_clock != 0 or record.fullmove_number != 1:
+        headers += [('SetUp', '1'), ('FEN', game.get_fen())]
+    sans = []
+    for index in record.moves:
+        moves = game.get_valid_moves()
+        move = sorted(moves, key=move_order)[index]
+        sans.append(san(game, move, moves))
+        game.make_move(move)
+    return format_game(headers, sans, record.result, black_first, first_move_number)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and query a binary game archive.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="print games as PGN")
+    show.add_argument("archive")
+    show.add_argument("--limit", type=int)
+    find = commands.add_parser("find", help="list the games that reach a position")
+    find.add_argument("archive")
+    find.add_argument("fen")
+    index = commands.add_parser("index", help="rebuild the position index")
+    index.add_argument("archive")
+    args = parser.parse_args(argv)
+
+    if args.command == "index":
+        build_index(args.archive)
+        return 0
+    game = BACKENDS['bitboard']()
+    with ArchiveReader(args.archive, use_index=args.command == "find") as reader:
+        if args.command == "show":
+            for count, record in enumerate(reader):
+                if args.limit is not None and count >= args.limit:
+                    break
+                sys.stdout.write(to_pgn(record, game, [('Round', count + 1)]))
+        else:
+            game.load_fen(args.fen)
+            for record in reader.games_reaching(game):
+                sys.stdout.write("%d  %s  %d plies\n" % (record.offset, record.result, len(record.moves)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+# The GameState implementations, by name. Everything that builds games from a backend option looks them up here.
+
+from Chess.ChessEngine import GameState
+from Chess.Bitboard import BitboardGameState
+
+BACKENDS = {'mailbox': GameState, 'bitboard': BitboardGameState}
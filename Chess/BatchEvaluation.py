@@ -0,0 +1,124 @@
+# Evaluation.evaluate for many positions at once with NumPy (an optional dependency: only this module needs it).
+# Positions are packed into an (N, 64) array of piece codes (ChessEngine.PIECE_CODES, the bytes of
+# GameState.get_packed_state) and every term is computed for the whole batch with integer array operations,
+# so the scores are exactly those of the scalar evaluator.
+
+import numpy as np
+
+from Chess.ChessEngine import BISHOP_DIRECTIONS, KNIGHT_DIRECTIONS, PIECE_CODE_OF, PIECE_CODES, ROOK_DIRECTIONS
+from Chess.Evaluation import (DOUBLED_PAWN_PENALTY, ISOLATED_PAWN_PENALTY, MOBILITY_WEIGHTS, PASSED_PAWN_BONUS,
+                              SQUARE_SCORES)
+
+EMPTY = 0
+WHITE_PAWN = PIECE_CODES.index('wp')
+BLACK_PAWN = PIECE_CODES.index('bp')
+# a square index past the board, always occupied, used to pad rays and knight jumps to a fixed length
+OFF_BOARD = 64
+
+
+def _square_score_table():
+    table = np.zeros((len(PIECE_CODES), 64), dtype=np.int32)
+    for code, piece in enumerate(PIECE_CODES):
+        if piece != '-':
+            table[code] = SQUARE_SCORES[piece] if piece[0] == 'w' else [-score for score in SQUARE_SCORES[piece]]
+    return table
+
+
+def _targets(sq, direction, length):
+    row, col = divmod(sq, 8)
+    squares = []
+    for i in range(1, length + 1):
+        r, c = row + direction[0] * i, col + direction[1] * i
+        if not (0 <= r <= 7 and 0 <= c <= 7):
+            break
+        squares.append(r * 8 + c)
+    return squares + [OFF_BOARD] * (length - len(squares))
+
+
+# (64, 8) knight jump squares and (64, 4, 8) ray squares, padded with OFF_BOARD so every ray ends on it
+KNIGHT_SQUARES = np.array([[_targets(sq, d, 1)[0] for d in KNIGHT_DIRECTIONS] for sq in range(64)])
+ROOK_RAYS = np.array([[_targets(sq, d, 8) for d in ROOK_DIRECTIONS] for sq in range(64)])
+BISHOP_RAYS = np.array([[_targets(sq, d, 8) for d in BISHOP_DIRECTIONS] for sq in range(64)])
+
+# SQUARE_SCORE[code, sq]: material plus table value, negative for black pieces
+SQUARE_SCORE = _square_score_table()
+
+# MOBILITY_WEIGHT[code]: signed centipawns per empty square the piece reaches
+MOBILITY_WEIGHT = np.array([0 if piece == '-' else MOBILITY_WEIGHTS.get(piece[1], 0) * (1 if piece[0] == 'w' else -1)
+                            for piece in PIECE_CODES], dtype=np.int32)
+# which of the knight, diagonal and orthogonal mobility counts apply to each piece code
+MOVES_LIKE_KNIGHT = np.array([piece[1:] == 'N' for piece in PIECE_CODES], dtype=np.int32)
+MOVES_DIAGONALLY = np.array([piece[1:] in ('B', 'Q') for piece in PIECE_CODES], dtype=np.int32)
+MOVES_ORTHOGONALLY = np.array([piece[1:] in ('R', 'Q') for piece in PIECE_CODES], dtype=np.int32)
+
+
+# FRONT_SPAN[colour][sq, other]: other is ahead of a pawn of that colour on sq, on its own or a neighbouring file
+def _front_span(white):
+    span = np.zeros((64, 64), dtype=np.int32)
+    for sq in range(64):
+        for other in range(64):
+            ahead = other // 8 < sq // 8 if white else other // 8 > sq // 8
+            span[sq, other] = ahead and abs(other % 8 - sq % 8) <= 1
+    return span
+
+
+WHITE_FRONT_SPAN = _front_span(True)
+BLACK_FRONT_SPAN = _front_span(False)
+WHITE_PASSED_BONUS = np.array([PASSED_PAWN_BONUS[7 - sq // 8] for sq in range(64)], dtype=np.int32)
+BLACK_PASSED_BONUS = np.array([PASSED_PAWN_BONUS[sq // 8] for sq in range(64)], dtype=np.int32)
+
+
+# (boards, white_to_move) arrays for a sequence of GameStates
+def pack_games(games):
+    data = np.frombuffer(b''.join(game.get_packed_state() for game in games), dtype=np.uint8).reshape(-1, 66)
+    return data[:, :64].astype(np.int8), data[:, 64] == 1
+
+
+# (N, 64) piece codes for a sequence of GameState.board lists
+def pack_boards(boards):
+    return np.array([[PIECE_CODE_OF[piece] for row in board for piece in row] for board in boards], dtype=np.int8)
+
+
+# Empty squares along each ray up to the first occupied one (the index of the first non-empty square, which
+# OFF_BOARD guarantees), for the pieces at (positions, squares)
+def _ray_mobility(empty, positions, squares, rays):
+    return empty[positions[:, None, None], rays[squares]].argmin(axis=2).sum(axis=1)
+
+
+# Pawn structure from white's point of view for an (N, 64) mask of each side's pawns
+def _pawn_structure(own, enemy, front_span, passed_bonus):
+    files = own.reshape(-1, 8, 8).sum(axis=1)
+    doubled = np.maximum(files - 1, 0).sum(axis=1)
+    padded = np.pad(files, ((0, 0), (1, 1)))
+    isolated = (files * ((padded[:, :-2] + padded[:, 2:]) == 0)).sum(axis=1)
+    # float matmul is exact for these small counts and much faster than an integer one
+    blockers = enemy.astype(np.float64) @ front_span.T
+    passed = (own * (blockers == 0) * passed_bonus).sum(axis=1)
+    return passed - DOUBLED_PAWN_PENALTY * doubled - ISOLATED_PAWN_PENALTY * isolated
+
+
+# Scores of the packed positions (an N-vector of int32), each relative to its side to move
+def evaluate_batch(boards, white_to_move):
+    boards = np.asarray(boards, dtype=np.int64)
+    count = len(boards)
+    score = SQUARE_SCORE[boards, np.arange(64)].sum(axis=1)
+
+    # mobility only for the squares holding a knight, bishop, rook or queen
+    empty = np.zeros((count, 65), dtype=bool)
+    empty[:, :64] = boards == EMPTY
+    positions, squares = np.nonzero(MOBILITY_WEIGHT[boards])
+    codes = boards[positions, squares]
+    reach = MOVES_LIKE_KNIGHT[codes] * empty[positions[:, None], KNIGHT_SQUARES[squares]].sum(axis=1)
+    reach += MOVES_DIAGONALLY[codes] * _ray_mobility(empty, positions, squares, BISHOP_RAYS)
+    reach += MOVES_ORTHOGONALLY[codes] * _ray_mobility(empty, positions, squares, ROOK_RAYS)
+    score += np.bincount(positions, MOBILITY_WEIGHT[codes] * reach, minlength=count).astype(np.int64)
+
+    white_pawns = (boards == WHITE_PAWN).astype(np.int32)
+    black_pawns = (boards == BLACK_PAWN).astype(np.int32)
+    score += _pawn_structure(white_pawns, black_pawns, WHITE_FRONT_SPAN, WHITE_PASSED_BONUS)
+    score -= _pawn_structure(black_pawns, white_pawns, BLACK_FRONT_SPAN, BLACK_PASSED_BONUS)
+    return np.where(white_to_move, score, -score).astype(np.int32)
+
+
+def evaluate_games(games):
+    return evaluate_batch(*pack_games(games))
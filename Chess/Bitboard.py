@@ -0,0 +1,459 @@
+# Bitboard backed GameState. The 64 bit piece sets are the primary state: make_move and undo_move update them
+# and the Zobrist key directly, and moves, checks, pins and attacks all come from them and precomputed attack
+# tables. The mailbox board of ChessEngine.GameState is kept in step square by square for what reads it
+# (evaluation, drawing, FEN and Move construction), but nothing scans it.
+# Squares are numbered row * 8 + col, the same numbering Move.moveID uses.
+
+from Chess.ChessEngine import (ALL_MOVES, CAPTURES, LINE_STEPS, PROMOTIONS, QUIETS, ZOBRIST_BLACK_TO_MOVE,
+                               ZOBRIST_ENPASSANT, ZOBRIST_PIECES, GameState, Move)
+
+FULL = (1 << 64) - 1
+
+# (row, col) tuple for every square, built once so move generation does not allocate them
+SQUARES = tuple((sq // 8, sq % 8) for sq in range(64))
+
+# Directions that increase the square index come first, their first blocker is the lowest set bit
+ORTHOGONAL = ((1, 0), (0, 1), (-1, 0), (0, -1))
+DIAGONAL = ((1, 1), (1, -1), (-1, -1), (-1, 1))
+POSITIVE_DIRECTIONS = ((1, 0), (0, 1), (1, 1), (1, -1))
+
+
+def _bit(row, col):
+    return 1 << (row * 8 + col)
+
+
+def _step_table(steps):
+    table = []
+    for sq in range(64):
+        row, col = SQUARES[sq]
+        mask = 0
+        for dr, dc in steps:
+            if 0 <= row + dr <= 7 and 0 <= col + dc <= 7:
+                mask |= _bit(row + dr, col + dc)
+        table.append(mask)
+    return tuple(table)
+
+
+def _ray_table(direction):
+    table = []
+    for sq in range(64):
+        row, col = SQUARES[sq]
+        mask = 0
+        row, col = row + direction[0], col + direction[1]
+        while 0 <= row <= 7 and 0 <= col <= 7:
+            mask |= _bit(row, col)
+            row, col = row + direction[0], col + direction[1]
+        table.append(mask)
+    return tuple(table)
+
+
+KNIGHT_ATTACKS = _step_table(((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2)))
+KING_ATTACKS = _step_table(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+# squares a pawn of the given colour attacks from each square
+PAWN_ATTACKS = {'w': _step_table(((-1, -1), (-1, 1))), 'b': _step_table(((1, -1), (1, 1)))}
+
+# (ray table, first blocker is the lowest bit) for each sliding direction
+ROOK_RAYS = tuple((_ray_table(d), d in POSITIVE_DIRECTIONS) for d in ORTHOGONAL)
+BISHOP_RAYS = tuple((_ray_table(d), d in POSITIVE_DIRECTIONS) for d in DIAGONAL)
+# every square a rook or bishop on sq reaches on an empty board, so sliders off those lines are skipped cheaply
+ROOK_LINES = tuple(sum(table[sq] for table, positive in ROOK_RAYS) for sq in range(64))
+BISHOP_LINES = tuple(sum(table[sq] for table, positive in BISHOP_RAYS) for sq in range(64))
+
+
+def _between_table():
+    table = [[0] * 64 for _ in range(64)]
+    for direction in ORTHOGONAL + DIAGONAL:
+        for sq in range(64):
+            row, col = SQUARES[sq]
+            mask = 0
+            row, col = row + direction[0], col + direction[1]
+            while 0 <= row <= 7 and 0 <= col <= 7:
+                # squares strictly between sq and the target, plus the target itself
+                table[sq][row * 8 + col] = mask | _bit(row, col)
+                mask |= _bit(row, col)
+                row, col = row + direction[0], col + direction[1]
+    return tuple(tuple(row) for row in table)
+
+
+BETWEEN = _between_table()
+
+ROW_MASKS = tuple(0xFF << (8 * row) for row in range(8))
+FILE_MASKS = tuple(0x0101010101010101 << col for col in range(8))
+
+
+def lsb(bb):
+    return (bb & -bb).bit_length() - 1
+
+
+def slider_attacks(sq, occupied, rays):
+    attacks = 0
+    for table, positive in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            first = (blockers & -blockers).bit_length() - 1 if positive else blockers.bit_length() - 1
+            ray ^= table[first]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(sq, occupied):
+    return slider_attacks(sq, occupied, ROOK_RAYS)
+
+
+def bishop_attacks(sq, occupied):
+    return slider_attacks(sq, occupied, BISHOP_RAYS)
+
+
+class BitboardGameState(GameState):
+    def __init__(self, fen=None):
+        super().__init__(fen)
+        self.bitboards = {}
+        self.occupancy = {}
+        self.sync_bitboards()
+
+    # Rebuild every bitboard from the mailbox board, needed whenever the board is set up directly
+    def sync_bitboards(self):
+        self.bitboards = {colour + piece: 0 for colour in 'wb' for piece in 'pNBRQK'}
+        self.occupancy = {'w': 0, 'b': 0}
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != '-':
+                    self.bitboards[piece] |= _bit(row, col)
+                    self.occupancy[piece[0]] |= _bit(row, col)
+
+    # The bitboards first, as the Zobrist key's en passant term reads them
+    def setup_position(self):
+        self.sync_bitboards()
+        super().setup_position()
+
+    # En passant term of the key (see GameState.enpassant_zobrist): a pawn of the side to move must stand where
+    # a pawn of the other side on the en passant square would attack
+    def enpassant_zobrist(self):
+        if not self.enpassant_possible:
+            return 0
+        row, col = self.enpassant_possible
+        if self.whiteToMove:
+            capturers = PAWN_ATTACKS['b'][row * 8 + col] & self.bitboards['wp']
+        else:
+            capturers = PAWN_ATTACKS['w'][row * 8 + col] & self.bitboards['bp']
+        return ZOBRIST_ENPASSANT[col] if capturers else 0
+
+    def make_move(self, move):
+        board = self.board
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        piece = move.pieceMoved
+        captured = move.pieceCaptured
+        colour = piece[0]
+        start = move.moveID & 63
+        end = move.moveID >> 6
+        key = self.zobrist_key
+        if self.enpassant_possible:
+            key ^= self.enpassant_zobrist()
+        self.moveLog.append(move)
+        self.enpassant_log.append(self.enpassant_possible)
+        self.zobrist_log.append(self.zobrist_key)
+        self.halfmove_log.append(self.halfmove_clock)
+        self.halfmove_clock = 0 if piece[1] == 'p' or captured != '-' else self.halfmove_clock + 1
+
+        moved = 1 << start | 1 << end
+        bitboards[piece] ^= moved
+        occupancy[colour] ^= moved
+        board[start >> 3][start & 7] = '-'
+        key ^= ZOBRIST_PIECES[piece][start]
+        if captured != '-':
+            # en passant takes the pawn beside the start square, on the end square's file
+            captured_sq = (start & 56) | (end & 7) if move.isEnpassantMove else end
+            board[captured_sq >> 3][captured_sq & 7] = '-'
+            bitboards[captured] ^= 1 << captured_sq
+            occupancy[captured[0]] ^= 1 << captured_sq
+            key ^= ZOBRIST_PIECES[captured][captured_sq]
+        if move.isPawnPromotion:
+            bitboards[piece] ^= 1 << end
+            piece = colour + 'Q'
+            bitboards[piece] ^= 1 << end
+        board[end >> 3][end & 7] = piece
+        key ^= ZOBRIST_PIECES[piece][end] ^ ZOBRIST_BLACK_TO_MOVE
+        if piece[1] == 'K':
+            if colour == 'w':
+                self.white_king_loc = SQUARES[end]
+            else:
+                self.black_king_loc = SQUARES[end]
+
+        self.whiteToMove = not self.whiteToMove
+        if piece[1] == 'p' and (start - end == 16 or end - start == 16):
+            self.enpassant_possible = SQUARES[(start + end) >> 1]
+            key ^= self.enpassant_zobrist()
+        else:
+            self.enpassant_possible = ()
+        self.zobrist_key = key
+
+    def undo_move(self):
+        if not self.moveLog:
+            return
+        move = self.moveLog.pop()
+        board = self.board
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        piece = move.pieceMoved
+        captured = move.pieceCaptured
+        colour = piece[0]
+        start = move.moveID & 63
+        end = move.moveID >> 6
+        moved = 1 << start | 1 << end
+        bitboards[piece] ^= moved
+        occupancy[colour] ^= moved
+        if move.isPawnPromotion:
+            bitboards[piece] ^= 1 << end
+            bitboards[colour + 'Q'] ^= 1 << end
+        board[start >> 3][start & 7] = piece
+        board[end >> 3][end & 7] = '-'
+        if captured != '-':
+            captured_sq = (start & 56) | (end & 7) if move.isEnpassantMove else end
+            board[captured_sq >> 3][captured_sq & 7] = captured
+            bitboards[captured] ^= 1 << captured_sq
+            occupancy[captured[0]] ^= 1 << captured_sq
+        if piece[1] == 'K':
+            if colour == 'w':
+                self.white_king_loc = SQUARES[start]
+            else:
+                self.black_king_loc = SQUARES[start]
+        self.whiteToMove = not self.whiteToMove
+        self.enpassant_possible = self.enpassant_log.pop()
+        self.zobrist_key = self.zobrist_log.pop()
+        self.halfmove_clock = self.halfmove_log.pop()
+
+    # Bitboard of the pieces of the given colour attacking sq
+    def attackers_to(self, sq, colour, occupied):
+        bitboards = self.bitboards
+        queens = bitboards[colour + 'Q']
+        other = 'b' if colour == 'w' else 'w'
+        attackers = (KNIGHT_ATTACKS[sq] & bitboards[colour + 'N']) | (KING_ATTACKS[sq] & bitboards[colour + 'K']) | \
+                    (PAWN_ATTACKS[other][sq] & bitboards[colour + 'p'])
+        sliders = (bitboards[colour + 'R'] | queens) & ROOK_LINES[sq]
+        if sliders:
+            attackers |= rook_attacks(sq, occupied) & sliders
+        sliders = (bitboards[colour + 'B'] | queens) & BISHOP_LINES[sq]
+        if sliders:
+            attackers |= bishop_attacks(sq, occupied) & sliders
+        return attackers
+
+    def square_under_attack(self, r, c):
+        enemy_color = 'b' if self.whiteToMove else 'w'
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        return self.attackers_to(r * 8 + c, enemy_color, occupied) != 0
+
+    # The queries GameState answers from its attack maps, answered from the bitboards instead. As there, the
+    # other side's king does not block colour's attacks
+    def is_square_attacked(self, row, col, colour):
+        occupied = (self.occupancy['w'] | self.occupancy['b']) & ~self.bitboards[('b' if colour == 'w' else 'w') + 'K']
+        return self.attackers_to(row * 8 + col, colour, occupied) != 0
+
+    def get_attack_map(self, colour):
+        bitboards = self.bitboards
+        occupied = (self.occupancy['w'] | self.occupancy['b']) & ~bitboards[('b' if colour == 'w' else 'w') + 'K']
+        attacks = 0
+        for piece, table in (('p', PAWN_ATTACKS[colour]), ('N', KNIGHT_ATTACKS), ('K', KING_ATTACKS)):
+            pieces = bitboards[colour + piece]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                attacks |= table[bit.bit_length() - 1]
+        for piece, rays in (('R', ROOK_RAYS), ('B', BISHOP_RAYS)):
+            pieces = bitboards[colour + piece] | bitboards[colour + 'Q']
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                attacks |= slider_attacks(bit.bit_length() - 1, occupied, rays)
+        return attacks
+
+    def is_in_check(self):
+        ally_color, enemy_color = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        return self.attackers_to(lsb(self.bitboards[ally_color + 'K']), enemy_color, occupied) != 0
+
+    def is_pinned(self, row, col):
+        return self.get_pins_and_checks()[3].get(row * 8 + col, ())
+
+    # (in_check, pins, checks, pin_directions) in GameState's format
+    def get_pins_and_checks(self):
+        ally_color, enemy_color = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        king_sq = lsb(self.bitboards[ally_color + 'K'])
+        king_row, king_col = SQUARES[king_sq]
+        checks = []
+        checkers = self.attackers_to(king_sq, enemy_color, occupied)
+        while checkers:
+            bit = checkers & -checkers
+            checkers ^= bit
+            row, col = SQUARES[bit.bit_length() - 1]
+            step = LINE_STEPS[king_sq * 64 + row * 8 + col]
+            checks.append((row, col) + (step if step is not None else (row - king_row, col - king_col)))
+        pin_directions = {sq: LINE_STEPS[king_sq * 64 + sq]
+                          for sq in self.get_pins(king_sq, ally_color, enemy_color, occupied)}
+        pins = [SQUARES[sq] + step for sq, step in pin_directions.items()]
+        return bool(checks), pins, checks, pin_directions
+
+    # Legal moves of the side to move's piece on (row, col)
+    def get_valid_moves_from(self, row, col):
+        return self.get_valid_moves(ALL_MOVES, 1 << (row * 8 + col))
+
+    # Pinned pieces of the side to move mapped to the squares they may still move to
+    def get_pins(self, king_sq, ally_color, enemy_color, occupied):
+        pins = {}
+        bitboards = self.bitboards
+        for rays, sliders in ((ROOK_RAYS, bitboards[enemy_color + 'R'] | bitboards[enemy_color + 'Q']),
+                              (BISHOP_RAYS, bitboards[enemy_color + 'B'] | bitboards[enemy_color + 'Q'])):
+            for table, positive in rays:
+                ray = table[king_sq]
+                if not ray & sliders:
+                    continue
+                blockers = ray & occupied
+                first = lsb(blockers) if positive else blockers.bit_length() - 1
+                if not (1 << first) & self.occupancy[ally_color]:
+                    continue
+                blockers = table[first] & occupied
+                if not blockers:
+                    continue
+                second = lsb(blockers) if positive else blockers.bit_length() - 1
+                if (1 << second) & sliders:
+                    pins[first] = BETWEEN[king_sq][second]
+        return pins
+
+    # only limits the moves to those of the pieces on its squares
+    def get_valid_moves(self, mode=ALL_MOVES, only=FULL):
+        moves = []
+        board = self.board
+        bitboards = self.bitboards
+        ally_color, enemy_color = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        own = self.occupancy[ally_color]
+        enemies = self.occupancy[enemy_color]
+        occupied = own | enemies
+        king = bitboards[ally_color + 'K']
+        king_sq = lsb(king)
+        checkers = self.attackers_to(king_sq, enemy_color, occupied)
+        self.in_check = checkers != 0
+        # squares the mode lets pieces move to
+        targets_allowed = (enemies if mode & CAPTURES else 0) | (~occupied & FULL if mode & QUIETS else 0)
+
+        # king moves, tested with the king lifted off the board so it cannot hide behind itself
+        without_king = occupied ^ king
+        targets = KING_ATTACKS[king_sq] & targets_allowed if king & only else 0
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            sq = bit.bit_length() - 1
+            if not self.attackers_to(sq, enemy_color, without_king):
+                moves.append(Move(SQUARES[king_sq], SQUARES[sq], board))
+        if checkers & (checkers - 1):
+            return moves
+
+        allowed = ~own & FULL
+        pieces_allowed = allowed & targets_allowed
+        if checkers:
+            # capture the checker or, for a slider, block the line to it
+            allowed &= BETWEEN[king_sq][lsb(checkers)] | checkers
+            pieces_allowed &= allowed
+        pins = self.get_pins(king_sq, ally_color, enemy_color, occupied)
+
+        for piece, attacks in (('N', None), ('B', bishop_attacks), ('R', rook_attacks), ('Q', None)):
+            pieces = bitboards[ally_color + piece] & only
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                sq = bit.bit_length() - 1
+                if piece == 'N':
+                    if sq in pins:
+                        continue
+                    targets = KNIGHT_ATTACKS[sq] & pieces_allowed
+                elif piece == 'Q':
+                    targets = (rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)) & pieces_allowed
+                else:
+                    targets = attacks(sq, occupied) & pieces_allowed
+                if sq in pins:
+                    targets &= pins[sq]
+                while targets:
+                    target = targets & -targets
+                    targets ^= target
+                    moves.append(Move(SQUARES[sq], SQUARES[target.bit_length() - 1], board))
+
+        self.get_pawn_moves_bb(ally_color, enemy_color, occupied, allowed, pins, king_sq, moves, mode, only)
+        return moves
+
+    def get_pawn_moves_bb(self, ally_color, enemy_color, occupied, allowed, pins, king_sq, moves, mode=ALL_MOVES,
+                          only=FULL):
+        board = self.board
+        enemies = self.occupancy[enemy_color]
+        empty = ~occupied & FULL
+        pawns = self.bitboards[ally_color + 'p'] & only
+        free = pawns
+        for sq in pins:
+            free &= ~(1 << sq)
+        last_row = ROW_MASKS[0] if ally_color == 'w' else ROW_MASKS[7]
+        pushes_allowed = allowed & ((last_row if mode & PROMOTIONS else 0) | (~last_row & FULL if mode & QUIETS else 0))
+        captures_allowed = allowed if mode & CAPTURES else 0
+
+        # unpinned pawns move as a set: shift the whole bitboard, then walk the targets
+        if ally_color == 'w':
+            single = (free >> 8) & empty
+            double = ((single & ROW_MASKS[5]) >> 8) & empty
+            left = ((free & ~FILE_MASKS[0]) >> 9) & enemies
+            right = ((free & ~FILE_MASKS[7]) >> 7) & enemies
+            shifts = ((single, 8, pushes_allowed), (double, 16, pushes_allowed), (left, 9, captures_allowed),
+                      (right, 7, captures_allowed))
+            forward = -8
+        else:
+            single = (free << 8) & empty
+            double = ((single & ROW_MASKS[2]) << 8) & empty
+            left = ((free & ~FILE_MASKS[0]) << 7) & enemies
+            right = ((free & ~FILE_MASKS[7]) << 9) & enemies
+            shifts = ((single, -8, pushes_allowed), (double, -16, pushes_allowed), (left, -7, captures_allowed),
+                      (right, -9, captures_allowed))
+            forward = 8
+        for targets, delta, targets_allowed in shifts:
+            targets &= targets_allowed
+            while targets:
+                target = targets & -targets
+                targets ^= target
+                sq = target.bit_length() - 1
+                moves.append(Move(SQUARES[sq + delta], SQUARES[sq], board))
+
+        start_row = 6 if ally_color == 'w' else 1
+        for sq in pins:
+            if not pawns & (1 << sq):
+                continue
+            one = sq + forward
+            targets = PAWN_ATTACKS[ally_color][sq] & enemies & captures_allowed
+            if not (1 << one) & occupied:
+                pushes = 1 << one
+                two = one + forward
+                if sq // 8 == start_row and not (1 << two) & occupied:
+                    pushes |= 1 << two
+                targets |= pushes & pushes_allowed
+            targets &= pins[sq]
+            while targets:
+                target = targets & -targets
+                targets ^= target
+                moves.append(Move(SQUARES[sq], SQUARES[target.bit_length() - 1], board))
+
+        if self.enpassant_possible and mode & CAPTURES:
+            ep_sq = self.enpassant_possible[0] * 8 + self.enpassant_possible[1]
+            # the pawns that could capture onto the en passant square sit where an enemy pawn there would attack
+            capturers = PAWN_ATTACKS[enemy_color][ep_sq] & pawns
+            while capturers:
+                bit = capturers & -capturers
+                capturers ^= bit
+                sq = bit.bit_length() - 1
+                if self.enpassant_is_legal_bb(sq, ep_sq, ep_sq - forward, enemy_color, occupied, king_sq):
+                    moves.append(Move(SQUARES[sq], SQUARES[ep_sq], board, isEnpassantMove=True))
+
+    # En passant removes two pieces from one line, so it is checked by trying it out on the occupancy
+    def enpassant_is_legal_bb(self, sq, ep_sq, captured_sq, enemy_color, occupied, king_sq):
+        captured = 1 << captured_sq
+        occupied = occupied ^ (1 << sq) ^ (1 << ep_sq) ^ captured
+        self.bitboards[enemy_color + 'p'] ^= captured
+        attacked = self.attackers_to(king_sq, enemy_color, occupied)
+        self.bitboards[enemy_color + 'p'] ^= captured
+        return not attacked
@@ -1,10 +1,108 @@
 # Stores all info about the current state of the chess game.
 # Also determines the valid moves. Keeps a move log.
 
-from const import *
+import random
+
+from Chess.const import *
+
+# Zobrist keys: a random 64 bit number per piece per square, one for black to move and one per en passant file.
+# Fixed seed so keys are the same in every process
+_zobrist_random = random.Random(20240611)
+ZOBRIST_PIECES = {colour + piece: tuple(_zobrist_random.getrandbits(64) for _ in range(64))
+                  for colour in 'wb' for piece in 'pNBRQK'}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_ENPASSANT = tuple(_zobrist_random.getrandbits(64) for _ in range(DIMENSION))
+
+# Move generation modes, combined with |
+CAPTURES = 1  # captures, including en passant and capturing promotions
+PROMOTIONS = 2  # promotions that do not capture
+QUIETS = 4  # everything else
+ALL_MOVES = CAPTURES | PROMOTIONS | QUIETS
+
+# Castling rights are always written as '-', the engine has no castling
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1"
+
+# Victim rank for MVV-LVA ordering
+CAPTURE_ORDER = {'p': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 9, 'K': 0}
+
+
+# Most valuable victim first, least valuable attacker breaking ties. 0 for non-captures
+def mvv_lva(move):
+    if move.pieceCaptured == '-':
+        return 0
+    return CAPTURE_ORDER[move.pieceCaptured[1]] * 16 - CAPTURE_ORDER[move.pieceMoved[1]] + 10
+
+
+# Byte code of each piece in packed states
+PIECE_CODES = ('-', 'wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+PIECE_CODE_OF = {piece: code for code, piece in enumerate(PIECE_CODES)}
+
+KNIGHT_DIRECTIONS = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2))
+KING_DIRECTIONS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, 1), (1, -1))
+SLIDER_DIRECTIONS = {'R': ROOK_DIRECTIONS, 'B': BISHOP_DIRECTIONS, 'Q': ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+
+
+# For each square (row * 8 + col), the squares one step away in the given directions
+def _step_targets(directions):
+    return tuple(tuple((row + dr, col + dc) for dr, dc in directions if 0 <= row + dr <= 7 and 0 <= col + dc <= 7)
+                 for row in range(DIMENSION) for col in range(DIMENSION))
+
+
+KNIGHT_TARGETS = _step_targets(KNIGHT_DIRECTIONS)
+KING_TARGETS = _step_targets(KING_DIRECTIONS)
+KNIGHT_ATTACK_MASKS = tuple(sum(1 << (r * 8 + c) for r, c in targets) for targets in KNIGHT_TARGETS)
+KING_ATTACK_MASKS = tuple(sum(1 << (r * 8 + c) for r, c in targets) for targets in KING_TARGETS)
+FULL_MASK = (1 << 64) - 1
+
+
+# For each slider kind and square, its rays outward as tuples of (row, col, square bit), nearest square first
+def _slider_rays(directions):
+    rays = []
+    for row in range(DIMENSION):
+        for col in range(DIMENSION):
+            square_rays = []
+            for dr, dc in directions:
+                ray = []
+                end_row, end_col = row + dr, col + dc
+                while 0 <= end_row <= 7 and 0 <= end_col <= 7:
+                    ray.append((end_row, end_col, 1 << (end_row * 8 + end_col)))
+                    end_row += dr
+                    end_col += dc
+                if ray:
+                    square_rays.append(tuple(ray))
+            rays.append(tuple(square_rays))
+    return tuple(rays)
+
+
+SLIDER_RAYS = {kind: _slider_rays(directions) for kind, directions in SLIDER_DIRECTIONS.items()}
+
+
+# For every pair of squares [from * 64 + to] on a common rank, file or diagonal: the unit step from the first
+# towards the second (None when they share no line) and the mask of the squares strictly between them
+def _line_tables():
+    steps = [None] * 4096
+    between = [0] * 4096
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        for dr, dc in KING_DIRECTIONS:
+            mask = 0
+            end_row, end_col = row + dr, col + dc
+            while 0 <= end_row <= 7 and 0 <= end_col <= 7:
+                steps[sq * 64 + end_row * 8 + end_col] = (dr, dc)
+                between[sq * 64 + end_row * 8 + end_col] = mask
+                mask |= 1 << (end_row * 8 + end_col)
+                end_row += dr
+                end_col += dc
+    return tuple(steps), tuple(between)
+
+
+LINE_STEPS, BETWEEN_MASKS = _line_tables()
+
 
 class GameState:
-    def __init__(self):
+    def __init__(self, fen=None):
 
         self.board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
@@ -25,12 +123,210 @@ class GameState:
         self.pins = []
         self.checks = []
         self.in_check = False
+        # pinned square (row * 8 + col) -> pin direction, for the position get_valid_moves last looked at
+        self.pin_directions = {}
         self.enpassant_possible = ()
+        # Attack information of the current position, filled in on first use: [white attack map, black attack map,
+        # (in_check, pins, checks, pin_directions), piece attacks]. Piece attacks are (attack mask of the piece on
+        # each square, white squares, black squares, slider squares); a position derives them from its parent's,
+        # updating only what the last move touched. make_move starts a fresh entry and undo_move gets the previous
+        # one back from attack_log
+        self.attack_info = [None, None, None, None]
+        self.attack_log = []
+        # en passant square before each move in moveLog, so undo_move can restore it
+        self.enpassant_log = []
+        self.zobrist_key = self.compute_zobrist_key()
+        # key of the position before each move in moveLog
+        self.zobrist_log = []
+        # FEN move counters of the position moveLog starts from; get_fen counts on from them
+        self.start_halfmove_clock = 0
+        self.start_fullmove_number = 1
+        self.start_black_to_move = False
+        # plies since the last capture or pawn move, and its value before each move in moveLog
+        self.halfmove_clock = 0
+        self.halfmove_log = []
+        if fen is not None:
+            self.load_fen(fen)
+
+    # Hash of the position, updated move by move so reading it is O(1)
+    @property
+    def position_key(self):
+        return self.zobrist_key
+
+    # Full hash from scratch. make_move and undo_move keep zobrist_key equal to this
+    def compute_zobrist_key(self):
+        key = 0
+        for row in range(DIMENSION):
+            for col in range(DIMENSION):
+                piece = self.board[row][col]
+                if piece != '-':
+                    key ^= ZOBRIST_PIECES[piece][row * 8 + col]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key ^ self.enpassant_zobrist()
+
+    # Key term of the en passant square: only when a pawn of the side to move stands next to the pawn that
+    # just moved (as in the Polyglot key), so a double push nobody can answer does not split transpositions
+    def enpassant_zobrist(self):
+        if not self.enpassant_possible:
+            return 0
+        row, col = self.enpassant_possible
+        pawn, pawn_row = ('wp', row + 1) if self.whiteToMove else ('bp', row - 1)
+        beside = self.board[pawn_row]
+        if (col > 0 and beside[col - 1] == pawn) or (col < 7 and beside[col + 1] == pawn):
+            return ZOBRIST_ENPASSANT[col]
+        return 0
+
+    # Set up the position from a FEN string (an EPD line's first four fields also work).
+    # Castling rights are ignored as castling is not supported
+    def load_fen(self, fen):
+        fields = fen.split()
+        if not fields:
+            raise ValueError("empty FEN")
+        board = []
+        for rank in fields[0].split('/'):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(['-'] * int(char))
+                elif char in 'pnbrqkPNBRQK':
+                    row.append(('w' if char.isupper() else 'b') + (char.upper() if char.upper() != 'P' else 'p'))
+                else:
+                    raise ValueError("bad piece %r in FEN %r" % (char, fen))
+            if len(row) != DIMENSION:
+                raise ValueError("rank %r of FEN %r is not %d squares" % (rank, fen, DIMENSION))
+            board.append(row)
+        if len(board) != DIMENSION:
+            raise ValueError("FEN %r does not have %d ranks" % (fen, DIMENSION))
+        for king in ('wK', 'bK'):
+            if sum(row.count(king) for row in board) != 1:
+                raise ValueError("FEN %r does not have exactly one %s king"
+                                 % (fen, 'white' if king[0] == 'w' else 'black'))
+        if len(fields) > 1 and fields[1] not in ('w', 'b'):
+            raise ValueError("bad side to move %r in FEN %r" % (fields[1], fen))
+        enpassant = fields[3] if len(fields) > 3 else '-'
+        if enpassant != '-' and (len(enpassant) != 2 or enpassant[0] not in Move.files_to_cols
+                                 or enpassant[1] not in Move.ranks_to_rows):
+            raise ValueError("bad en passant square %r in FEN %r" % (enpassant, fen))
+        self.board = board
+        self.whiteToMove = len(fields) < 2 or fields[1] == 'w'
+        if enpassant != '-':
+            self.enpassant_possible = (Move.ranks_to_rows[enpassant[1]], Move.files_to_cols[enpassant[0]])
+        else:
+            self.enpassant_possible = ()
+        self.start_halfmove_clock = int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0
+        self.start_fullmove_number = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+        self.start_black_to_move = not self.whiteToMove
+        self.setup_position()
+
+    def get_fen(self):
+        ranks = []
+        for row in self.board:
+            rank, empty = '', 0
+            for piece in row:
+                if piece == '-':
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1].upper() if piece[0] == 'w' else piece[1].lower()
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        if self.enpassant_possible:
+            row, col = self.enpassant_possible
+            enpassant = Move.cols_to_files[col] + Move.rows_to_ranks[row]
+        else:
+            enpassant = '-'
+        return "%s %s - %s %d %d" % ('/'.join(ranks), 'w' if self.whiteToMove else 'b', enpassant,
+                                     self.get_halfmove_clock(), self.get_fullmove_number())
+
+    # Plies since the last capture or pawn move (fifty move rule counter)
+    def get_halfmove_clock(self):
+        return self.halfmove_clock
+
+    # Counters of a position set up some other way than from a FEN (e.g. a packed state), before any move is made
+    def set_move_counters(self, halfmove_clock, fullmove_number):
+        self.start_halfmove_clock = self.halfmove_clock = halfmove_clock
+        self.start_fullmove_number = fullmove_number
+
+    # How often the current position occurred before, counting only positions with the same side to move since
+    # the last capture or pawn move (no earlier one can be the same) and stopping once limit are found
+    def repetitions(self, limit=2):
+        log = self.zobrist_log
+        key = self.zobrist_key
+        found = 0
+        for i in range(len(log) - 4, max(len(log) - self.halfmove_clock, 0) - 1, -2):
+            if log[i] == key:
+                found += 1
+                if found >= limit:
+                    break
+        return found
+
+    # Keys of the positions since the last capture or pawn move, all a later position can repeat. This is the
+    # history to send along with a packed state, for set_history at the other end
+    def reversible_history(self):
+        return self.zobrist_log[max(len(self.zobrist_log) - self.halfmove_clock, 0):]
+
+    # Take keys (from reversible_history) as the positions played before this one, so repeating them is seen
+    def set_history(self, keys):
+        self.zobrist_log = list(keys)
+        self.set_move_counters(len(self.zobrist_log), self.start_fullmove_number)
+
+    def get_fullmove_number(self):
+        return self.start_fullmove_number + (len(self.moveLog) + self.start_black_to_move) // 2
+
+    # Compact position for sending to other processes: one byte per square, side to move, en passant square
+    def get_packed_state(self):
+        codes = bytearray(PIECE_CODE_OF[piece] for row in self.board for piece in row)
+        codes.append(1 if self.whiteToMove else 0)
+        codes.append(self.enpassant_possible[0] * 8 + self.enpassant_possible[1] if self.enpassant_possible else 255)
+        return bytes(codes)
+
+    def load_packed_state(self, data):
+        self.board = [[PIECE_CODES[code] for code in data[row * 8:row * 8 + 8]] for row in range(DIMENSION)]
+        self.whiteToMove = data[64] == 1
+        self.enpassant_possible = divmod(data[65], 8) if data[65] != 255 else ()
+        self.start_halfmove_clock = 0
+        self.start_fullmove_number = 1
+        self.start_black_to_move = not self.whiteToMove
+        self.setup_position()
+
+    # Recompute everything derived from board, whiteToMove and enpassant_possible, and clear the history
+    def setup_position(self):
+        for row in range(DIMENSION):
+            for col in range(DIMENSION):
+                if self.board[row][col] == 'wK':
+                    self.white_king_loc = (row, col)
+                elif self.board[row][col] == 'bK':
+                    self.black_king_loc = (row, col)
+        self.moveLog = []
+        self.enpassant_log = []
+        self.zobrist_key = self.compute_zobrist_key()
+        self.zobrist_log = []
+        self.halfmove_clock = self.start_halfmove_clock
+        self.halfmove_log = []
+        self.checkmate = False
+        self.stalemate = False
+        self.pins = []
+        self.checks = []
+        self.in_check = False
+        self.pin_directions = {}
+        self.attack_info = [None, None, None, None]
+        self.attack_log = []
 
     def make_move(self, move):
+        key = self.zobrist_key ^ self.enpassant_zobrist()
         self.board[move.endRow][move.endCol] = self.board[move.startRow][move.startCol]
         self.board[move.startRow][move.startCol] = "-"
         self.moveLog.append(move)
+        self.enpassant_log.append(self.enpassant_possible)
+        self.zobrist_log.append(self.zobrist_key)
+        self.halfmove_log.append(self.halfmove_clock)
+        self.halfmove_clock = 0 if move.pieceMoved[1] == 'p' or move.pieceCaptured != '-' else self.halfmove_clock + 1
+        self.attack_log.append(self.attack_info)
+        self.attack_info = [None, None, None, None]
         self.whiteToMove = not self.whiteToMove
         if move.pieceMoved == 'wK':
             self.white_king_loc = (move.endRow, move.endCol)
@@ -45,15 +341,21 @@ class GameState:
 
         if move.pieceMoved[1] == 'p' and abs(move.endRow - move.startRow) == 2:
             self.enpassant_possible = ((move.startRow + move.endRow)//2 , move.endCol)
-            print("Enpassant moves: ", self.enpassant_possible)
         else:
             self.enpassant_possible = ()
 
+        key ^= ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_PIECES[move.pieceMoved][move.startRow * 8 + move.startCol]
+        key ^= ZOBRIST_PIECES[self.board[move.endRow][move.endCol]][move.endRow * 8 + move.endCol]
+        if move.pieceCaptured != '-':
+            captured_row = move.startRow if move.isEnpassantMove else move.endRow
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][captured_row * 8 + move.endCol]
+        self.zobrist_key = key ^ self.enpassant_zobrist()
+
 
     def undo_move(self):
         if len(self.moveLog) != 0:
             move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = self.board[move.endRow][move.endCol]
+            self.board[move.startRow][move.startCol] = move.pieceMoved
             self.board[move.endRow][move.endCol] = move.pieceCaptured
             self.whiteToMove = not self.whiteToMove
             if move.pieceMoved == 'wK':
@@ -63,14 +365,15 @@ class GameState:
             if move.isEnpassantMove:
                 self.board[move.endRow][move.endCol] = '-'
                 self.board[move.startRow][move.endCol] = move.pieceCaptured
-                self.enpassant_possible = (move.endRow, move.endCol)
-            if move.pieceMoved[1] == 'p' and abs(move.endRow - move.startRow) == 2:
-                self.enpassant_possible = ()
+            self.enpassant_possible = self.enpassant_log.pop()
+            self.zobrist_key = self.zobrist_log.pop()
+            self.halfmove_clock = self.halfmove_log.pop()
+            self.attack_info = self.attack_log.pop()
 
-    def get_valid_moves(self):
+    def get_valid_moves(self, mode=ALL_MOVES):
         temp_enpassant_possible = self.enpassant_possible
         moves = []
-        self.in_check, self.pins, self.checks = self.check_for_pins_and_checks()
+        self.in_check, self.pins, self.checks, self.pin_directions = self.get_pins_and_checks()
         if self.whiteToMove:
             king_row = self.white_king_loc[0]
             king_col = self.white_king_loc[1]
@@ -79,44 +382,240 @@ class GameState:
             king_col = self.black_king_loc[1]
         if self.in_check:
             if len(self.checks) == 1:
-                moves = self.get_possible_moves()
-                check_row, check_col = self.checks[0][0], self.checks[0][1]
-                piece_checking = self.board[check_row][check_col]
-                valid_squares = []
-                if piece_checking[1] == 'N':
-                    valid_squares = [(check_row, check_col)]
-                else:
-                    for i in range(1, 8):
-                        valid_square = (king_row + self.checks[0][2] * i, king_col + self.checks[0][3] * i)
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[1] == check_col:
-                            break
-                for i in range(len(moves) - 1, -1, -1):
-                    if moves[i].pieceMoved[1] != 'K':
-                        if not (moves[i].endRow, moves[i].endCol) in valid_squares:
-                            moves.remove(moves[i])
+                moves = self.filter_evasions(self.get_possible_moves(mode), king_row, king_col)
             else:
-                self.get_king_moves(king_row, king_col, moves)
+                self.get_king_moves(king_row, king_col, moves, mode)
         else:
-            moves = self.get_possible_moves()
+            moves = self.get_possible_moves(mode)
 
         self.enpassant_possible = temp_enpassant_possible
         return moves
 
+    # Legal moves of the side to move's piece on (row, col)
+    def get_valid_moves_from(self, row, col):
+        moves = []
+        self.in_check, self.pins, self.checks, self.pin_directions = self.get_pins_and_checks()
+        piece = self.board[row][col]
+        if piece[0] != ('w' if self.whiteToMove else 'b'):
+            return moves
+        if piece[1] != 'K' and len(self.checks) > 1:
+            return moves
+        self.move_functions[piece[1]](self, row, col, moves)
+        if self.in_check:
+            if self.whiteToMove:
+                moves = self.filter_evasions(moves, self.white_king_loc[0], self.white_king_loc[1])
+            else:
+                moves = self.filter_evasions(moves, self.black_king_loc[0], self.black_king_loc[1])
+        return moves
+
+    # With a single check only king moves, en passant (checked when generated) and moves that capture
+    # the checker or block its line are left
+    def filter_evasions(self, moves, king_row, king_col):
+        check_row, check_col, check_dir_row, check_dir_col = self.checks[0]
+        if self.board[check_row][check_col][1] == 'N':
+            valid_squares = {(check_row, check_col)}
+        else:
+            valid_squares = set()
+            for i in range(1, 8):
+                valid_square = (king_row + check_dir_row * i, king_col + check_dir_col * i)
+                valid_squares.add(valid_square)
+                if valid_square[0] == check_row and valid_square[1] == check_col:
+                    break
+        return [move for move in moves if move.pieceMoved[1] == 'K' or move.isEnpassantMove or
+                (move.endRow, move.endCol) in valid_squares]
+
     def in_check(self):
         if self.whiteToMove:
             return self.square_under_attack(self.white_king_loc[0], self.white_king_loc[1])
         else:
             return self.square_under_attack(self.black_king_loc[0], self.black_king_loc[1])
 
+    # Whether the side to move is in check, without generating moves
+    def is_in_check(self):
+        return self.get_pins_and_checks()[0]
+
     def square_under_attack(self, r, c):
-        self.whiteToMove = not self.whiteToMove
-        opp_moves = self.get_possible_moves()
-        self.whiteToMove = not self.whiteToMove
-        for move in opp_moves:
-            if move.endRow == r and move.endCol == c:
-                return True
-        return False
+        return self.is_square_attacked(r, c, 'b' if self.whiteToMove else 'w')
+
+    def is_square_attacked(self, row, col, colour):
+        return (self.get_attack_map(colour) >> (row * 8 + col)) & 1 == 1
+
+    # Direction of the pin on the side to move's piece at (row, col), or () when it is free to move
+    def is_pinned(self, row, col):
+        return self.get_pins_and_checks()[3].get(row * 8 + col, ())
+
+    # Squares attacked by colour as a 64 bit mask, built once per position
+    def get_attack_map(self, colour):
+        index = 0 if colour == 'w' else 1
+        attack_map = self.attack_info[index]
+        if attack_map is None:
+            attack_map = self.attack_info[index] = self.compute_attack_map(colour)
+        return attack_map
+
+    # Union of the attacks of colour's pieces
+    def compute_attack_map(self, colour):
+        attacks, white, black, sliders = self.get_piece_attacks()
+        pieces = white if colour == 'w' else black
+        attack_map = 0
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            attack_map |= attacks[bit.bit_length() - 1]
+        return attack_map
+
+    # Piece attacks of the current position: updated from the parent position's when it has them, which it
+    # does whenever moves were generated there, so a search only builds them from scratch at its root
+    def get_piece_attacks(self):
+        info = self.attack_info
+        piece_attacks = info[3]
+        if piece_attacks is None:
+            parent = self.attack_log[-1][3] if self.attack_log else None
+            if parent is not None:
+                piece_attacks = info[3] = self.update_piece_attacks(parent, self.moveLog[-1])
+            else:
+                piece_attacks = info[3] = self.compute_piece_attacks()
+        return piece_attacks
+
+    def compute_piece_attacks(self):
+        board = self.board
+        attacks = [0] * 64
+        white = black = sliders = 0
+        for row in range(DIMENSION):
+            for col in range(DIMENSION):
+                piece = board[row][col]
+                if piece == '-':
+                    continue
+                bit = 1 << (row * 8 + col)
+                if piece[0] == 'w':
+                    white |= bit
+                else:
+                    black |= bit
+                if piece[1] in SLIDER_DIRECTIONS:
+                    sliders |= bit
+                attacks[row * 8 + col] = self.piece_attack_mask(row, col, piece)
+        return attacks, white, black, sliders
+
+    # The parent's piece attacks with move made: the moved and captured pieces change, and so do the sliders
+    # whose attacks reach a square the move emptied or filled. Nothing else can have changed
+    def update_piece_attacks(self, parent, move):
+        attacks, white, black, sliders = parent
+        attacks = attacks[:]
+        start = move.startRow * 8 + move.startCol
+        end = move.endRow * 8 + move.endCol
+        changed = 1 << start | 1 << end
+        if move.pieceMoved[0] == 'w':
+            white ^= changed
+        else:
+            black ^= changed
+        attacks[start] = 0
+        sliders &= ~(1 << start) & FULL_MASK
+        if move.pieceCaptured != '-':
+            captured = 1 << (move.startRow * 8 + move.endCol) if move.isEnpassantMove else 1 << end
+            changed |= captured
+            if move.pieceCaptured[0] == 'w':
+                white ^= captured
+            else:
+                black ^= captured
+            attacks[captured.bit_length() - 1] = 0
+            sliders &= ~captured & FULL_MASK
+        piece = self.board[move.endRow][move.endCol]
+        attacks[end] = self.piece_attack_mask(move.endRow, move.endCol, piece)
+        if piece[1] in SLIDER_DIRECTIONS:
+            sliders |= 1 << end
+        others = sliders & ~(1 << end)
+        while others:
+            bit = others & -others
+            others ^= bit
+            sq = bit.bit_length() - 1
+            if attacks[sq] & changed:
+                row, col = divmod(sq, 8)
+                attacks[sq] = self.piece_attack_mask(row, col, self.board[row][col])
+        return attacks, white, black, sliders
+
+    # Squares the piece on (row, col) attacks. The other side's king does not block, so a king stepping back
+    # along a checking line is still attacked
+    def piece_attack_mask(self, row, col, piece):
+        kind = piece[1]
+        if kind == 'p':
+            attacks = 0
+            target_row = row - 1 if piece[0] == 'w' else row + 1
+            if 0 < col:
+                attacks |= 1 << (target_row * 8 + col - 1)
+            if col < 7:
+                attacks |= 1 << (target_row * 8 + col + 1)
+            return attacks
+        if kind == 'N':
+            return KNIGHT_ATTACK_MASKS[row * 8 + col]
+        if kind == 'K':
+            return KING_ATTACK_MASKS[row * 8 + col]
+        board = self.board
+        enemy_king = 'bK' if piece[0] == 'w' else 'wK'
+        attacks = 0
+        for ray in SLIDER_RAYS[kind][row * 8 + col]:
+            for end_row, end_col, bit in ray:
+                attacks |= bit
+                end_piece = board[end_row][end_col]
+                if end_piece != '-' and end_piece != enemy_king:
+                    break
+        return attacks
+
+    # The side to move's check and pin information, read off the piece attacks: checkers are the enemy pieces
+    # attacking the king (pawns and knights found from the king's square, sliders from their attacks), and a
+    # piece is pinned when it is the only one between the king and an enemy slider that moves along that line.
+    # Pins are keyed by square in pin_directions too
+    def get_pins_and_checks(self):
+        pins_and_checks = self.attack_info[2]
+        if pins_and_checks is not None:
+            return pins_and_checks
+        attacks, white, black, sliders = self.get_piece_attacks()
+        board = self.board
+        if self.whiteToMove:
+            king_row, king_col = self.white_king_loc
+            allies, enemies, enemy_colour = white, black, 'b'
+        else:
+            king_row, king_col = self.black_king_loc
+            allies, enemies, enemy_colour = black, white, 'w'
+        king_sq = king_row * 8 + king_col
+        checks = []
+        knight = enemy_colour + 'N'
+        for row, col in KNIGHT_TARGETS[king_sq]:
+            if board[row][col] == knight:
+                checks.append((row, col, row - king_row, col - king_col))
+        pawn_row = king_row - 1 if enemy_colour == 'b' else king_row + 1
+        if 0 <= pawn_row <= 7:
+            pawn = enemy_colour + 'p'
+            for col in (king_col - 1, king_col + 1):
+                if 0 <= col <= 7 and board[pawn_row][col] == pawn:
+                    checks.append((pawn_row, col, pawn_row - king_row, col - king_col))
+        pieces = enemies & sliders
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            sq = bit.bit_length() - 1
+            if attacks[sq] >> king_sq & 1:
+                step = LINE_STEPS[king_sq * 64 + sq]
+                checks.append((sq // 8, sq % 8, step[0], step[1]))
+        pins = []
+        pin_directions = {}
+        occupied = white | black
+        pieces = enemies & sliders
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            sq = bit.bit_length() - 1
+            step = LINE_STEPS[king_sq * 64 + sq]
+            if step is None:
+                continue
+            kind = board[sq // 8][sq % 8][1]
+            if (kind == 'R' and step[0] and step[1]) or (kind == 'B' and not (step[0] and step[1])):
+                continue
+            between = BETWEEN_MASKS[king_sq * 64 + sq] & occupied
+            if between and not between & (between - 1) and between & allies:
+                pinned = between.bit_length() - 1
+                pins.append((pinned // 8, pinned % 8, step[0], step[1]))
+                pin_directions[pinned] = step
+        pins_and_checks = self.attack_info[2] = (bool(checks), pins, checks, pin_directions)
+        return pins_and_checks
 
     def check_for_pins_and_checks(self):
         pins = []
@@ -174,7 +673,7 @@ class GameState:
                     checks.append((end_row, end_col, move[0], move[1]))
         return in_check, pins, checks
 
-    def get_possible_moves(self):
+    def get_possible_moves(self, mode=ALL_MOVES):
         moves = []
         for row in range(DIMENSION):
             for col in range(DIMENSION):
@@ -182,27 +681,24 @@ class GameState:
                 if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
                     piece = self.board[row][col][1]
                     if piece == 'p':
-                        self.get_pawn_moves(row, col, moves)
+                        self.get_pawn_moves(row, col, moves, mode)
+                    elif mode == PROMOTIONS:
+                        continue
                     elif piece == 'R':
-                        self.get_rook_moves(row, col, moves)
+                        self.get_rook_moves(row, col, moves, mode)
                     elif piece == 'B':
-                        self.get_bishop_moves(row, col, moves)
+                        self.get_bishop_moves(row, col, moves, mode)
                     elif piece == 'N':
-                        self.get_knight_moves(row, col, moves)
+                        self.get_knight_moves(row, col, moves, mode)
                     elif piece == 'K':
-                        self.get_king_moves(row, col, moves)
+                        self.get_king_moves(row, col, moves, mode)
                     elif piece == 'Q':
-                        self.get_queen_moves(row, col, moves)
+                        self.get_queen_moves(row, col, moves, mode)
         return moves
 
     def check_for_piece_stream(self, row_dir, col_dir, moves, row, col):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                break
+        pin_direction = self.pin_directions.get(row * 8 + col, ())
+        piece_pinned = pin_direction != ()
         r, c = row + row_dir, col + col_dir
         while 0 <= r < DIMENSION and 0 <= c < DIMENSION:
             if self.board[r][c] != '-':
@@ -222,82 +718,54 @@ class GameState:
             end_col = col + d[1]
             if 0 <= end_row < DIMENSION and 0 <= end_col < DIMENSION:
                 if self.board[row][col][1] == 'K':
-                    ally_color = self.board[row][col][0]
-                    if ally_color == 'w':
-                        self.white_king_loc = (end_row, end_col)
-                    else:
-                        self.black_king_loc = (end_row, end_col)
-                    in_check, pins, checks = self.check_for_pins_and_checks()
-                    if not in_check:
+                    enemy_color = 'b' if self.board[row][col][0] == 'w' else 'w'
+                    if not self.is_square_attacked(end_row, end_col, enemy_color):
                         if self.board[end_row][end_col] == '-' or self.board[end_row][end_col][0] != self.board[row][col][0]:
                             moves.append(Move((row, col), (end_row, end_col), self.board))
-                    if ally_color == 'w':
-                        self.white_king_loc = (row, col)
-                    else:
-                        self.black_king_loc = (row, col)
 
                 if not pin_or_check and self.board[row][col][1] != 'K':
                     if self.board[end_row][end_col] == '-' or self.board[end_row][end_col][0] != self.board[row][col][0]:
                         moves.append(Move((row, col), (end_row, end_col), self.board))
 
-    def get_pawn_moves(self, row, col, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
+    def get_pawn_moves(self, row, col, moves, mode=ALL_MOVES):
+        pin_direction = self.pin_directions.get(row * 8 + col, ())
+        piece_pinned = pin_direction != ()
 
         if self.whiteToMove:
-            if self.board[row-1][col] == '-':
-                if not piece_pinned or pin_direction == (-1, 0):
-                    moves.append(Move((row,col), (row-1,col), self.board))
-                    if row == 6 and self.board[row-2][col] == '-':
-                        moves.append(Move((row,col), (row-2, col), self.board))
-            if 0<col:
-                if self.board[row-1][col-1][0] == 'b' and not (piece_pinned or pin_direction == (-1, -1)):
-                    moves.append(Move((row, col), (row - 1, col-1), self.board))
-                elif (row-1 , col-1) == self.enpassant_possible:
-                    print("EnPassant move")
-                    moves.append(Move((row, col), (row - 1, col-1), self.board, isEnpassantMove=True))
-            if col<7:
-                if self.board[row-1][col+1][0] == 'b' and not (piece_pinned or pin_direction == (-1, +1)):
-                    moves.append(Move((row, col), (row - 1, col+1), self.board))
-                elif (row-1 , col+1) == self.enpassant_possible:
-                    print("EnPassant move")
-                    moves.append(Move((row, col), (row - 1, col+1), self.board, isEnpassantMove=True))
-
+            move_amount, start_row, enemy_color = -1, 6, 'b'
         else:
-            if self.board[row+1][col] == '-':
-                if not piece_pinned or pin_direction == (1, 0):
-                    moves.append(Move((row,col), (row+1,col), self.board))
-                    if row == 1 and self.board[row+2][col] == '-':
-                            moves.append(Move((row,col), (row+2, col), self.board))
-            if 0<col:
-                if self.board[row+1][col-1][0] == 'w' and not (piece_pinned or pin_direction == (1, -1)):
-                    moves.append(Move((row, col), (row + 1, col-1), self.board))
-                elif (row+1 , col-1) == self.enpassant_possible:
-                    print("EnPassant move")
-                    moves.append(Move((row, col), (row + 1, col-1), self.board, isEnpassantMove=True))
-            if col<7:
-                if self.board[row+1][col+1][0] == 'w' and not (piece_pinned or pin_direction == (1, 1 )):
-                    moves.append(Move((row, col), (row + 1, col+1), self.board))
-                elif (row+1 , col+1) == self.enpassant_possible:
-                    print("EnPassant move")
-                    moves.append(Move((row, col), (row + 1, col+1), self.board, isEnpassantMove=True))
-
-    def get_rook_moves(self, row, col, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                if self.board[row][col][1] != "Q":
-                    self.pins.remove(self.pins[i])
-                break
+            move_amount, start_row, enemy_color = 1, 1, 'w'
+
+        # a pinned pawn may only move along the line of its pin, towards or away from the king
+        promotes = row + move_amount in (0, 7)
+        if mode & (PROMOTIONS if promotes else QUIETS) and self.board[row + move_amount][col] == '-':
+            if not piece_pinned or pin_direction in ((move_amount, 0), (-move_amount, 0)):
+                moves.append(Move((row, col), (row + move_amount, col), self.board))
+                if row == start_row and self.board[row + 2 * move_amount][col] == '-':
+                    moves.append(Move((row, col), (row + 2 * move_amount, col), self.board))
+        if not mode & CAPTURES:
+            return
+        for col_amount in (-1, 1):
+            if 0 <= col + col_amount < DIMENSION:
+                if not piece_pinned or pin_direction in ((move_amount, col_amount), (-move_amount, -col_amount)):
+                    if self.board[row + move_amount][col + col_amount][0] == enemy_color:
+                        moves.append(Move((row, col), (row + move_amount, col + col_amount), self.board))
+                if (row + move_amount, col + col_amount) == self.enpassant_possible:
+                    if self.enpassant_is_legal(row, col, col + col_amount):
+                        moves.append(Move((row, col), (row + move_amount, col + col_amount), self.board, isEnpassantMove=True))
+
+    # En passant takes two pieces off one rank, which the pin scan cannot see. Try it on the board instead
+    def enpassant_is_legal(self, row, col, end_col):
+        end_row = self.enpassant_possible[0]
+        piece, captured = self.board[row][col], self.board[row][end_col]
+        self.board[row][col], self.board[row][end_col], self.board[end_row][end_col] = '-', '-', piece
+        in_check = self.check_for_pins_and_checks()[0]
+        self.board[row][col], self.board[row][end_col], self.board[end_row][end_col] = piece, captured, '-'
+        return not in_check
+
+    def get_rook_moves(self, row, col, moves, mode=ALL_MOVES):
+        pin_direction = self.pin_directions.get(row * 8 + col, ())
+        piece_pinned = pin_direction != ()
 
         directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
         enemy_color = "b" if self.whiteToMove else "w"
@@ -310,24 +778,20 @@ class GameState:
                     -direction[0], -direction[1]):
                         end_piece = self.board[end_row][end_col]
                         if end_piece == "-":
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
+                            if mode & QUIETS:
+                                moves.append(Move((row, col), (end_row, end_col), self.board))
                         elif end_piece[0] == enemy_color:
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
+                            if mode & CAPTURES:
+                                moves.append(Move((row, col), (end_row, end_col), self.board))
                             break
                         else:
                             break
                 else:
                     break
 
-    def get_bishop_moves(self, row, col, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
+    def get_bishop_moves(self, row, col, moves, mode=ALL_MOVES):
+        pin_direction = self.pin_directions.get(row * 8 + col, ())
+        piece_pinned = pin_direction != ()
 
         directions = ((-1, -1), (-1, 1), (1, 1), (1, -1))
         enemy_color = "b" if self.whiteToMove else "w"
@@ -340,22 +804,19 @@ class GameState:
                             -direction[0], -direction[1]):
                         end_piece = self.board[end_row][end_col]
                         if end_piece == "-":
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
+                            if mode & QUIETS:
+                                moves.append(Move((row, col), (end_row, end_col), self.board))
                         elif end_piece[0] == enemy_color:
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
+                            if mode & CAPTURES:
+                                moves.append(Move((row, col), (end_row, end_col), self.board))
                             break
                         else:
                             break
                 else:
                     break
 
-    def get_knight_moves(self, row, col, moves):
-        piece_pinned = False
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                self.pins.remove(self.pins[i])
-                break
+    def get_knight_moves(self, row, col, moves, mode=ALL_MOVES):
+        piece_pinned = row * 8 + col in self.pin_directions
         knight_moves = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2))
         ally_color = "w" if self.whiteToMove else "b"
         for move in knight_moves:
@@ -364,37 +825,33 @@ class GameState:
             if 0 <= end_row <= 7 and 0 <= end_col <= 7:
                 if not piece_pinned:
                     end_piece = self.board[end_row][end_col]
-                    if end_piece[0] != ally_color:
+                    if end_piece[0] != ally_color and mode & (QUIETS if end_piece == '-' else CAPTURES):
                         moves.append(Move((row, col), (end_row, end_col), self.board))
 
-    def get_queen_moves(self, row, col, moves):
-        self.get_bishop_moves(row, col, moves)
-        self.get_rook_moves(row, col, moves)
+    def get_queen_moves(self, row, col, moves, mode=ALL_MOVES):
+        self.get_bishop_moves(row, col, moves, mode)
+        self.get_rook_moves(row, col, moves, mode)
 
-    def get_king_moves(self, row, col, moves):
-        row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
+    def get_king_moves(self, row, col, moves, mode=ALL_MOVES):
         ally_color = "w" if self.whiteToMove else "b"
-        for i in range(8):
-            end_row = row + row_moves[i]
-            end_col = col + col_moves[i]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:
-                    if ally_color == "w":
-                        self.white_king_loc = (end_row, end_col)
-                    else:
-                        self.black_king_loc = (end_row, end_col)
-                    in_check, pins, checks = self.check_for_pins_and_checks()
-                    if not in_check:
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
-                    if ally_color == "w":
-                        self.white_king_loc = (row, col)
-                    else:
-                        self.black_king_loc = (row, col)
+        enemy_attacks = None
+        for end_row, end_col in KING_TARGETS[row * 8 + col]:
+            end_piece = self.board[end_row][end_col]
+            if end_piece[0] != ally_color and mode & (QUIETS if end_piece == '-' else CAPTURES):
+                if enemy_attacks is None:
+                    enemy_attacks = self.get_attack_map("b" if self.whiteToMove else "w")
+                if not (enemy_attacks >> (end_row * 8 + end_col)) & 1:
+                    moves.append(Move((row, col), (end_row, end_col), self.board))
+
+    move_functions = {'p': get_pawn_moves, 'R': get_rook_moves, 'B': get_bishop_moves, 'N': get_knight_moves,
+                      'K': get_king_moves, 'Q': get_queen_moves}
 
 
 class Move:
+    # Kept small: millions of these get built during search, so no per-move state beyond the move itself
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured',
+                 'isPawnPromotion', 'isEnpassantMove', 'moveID')
+
     # Move Maps
     ranks_to_rows = {
         "1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1,
@@ -408,24 +865,23 @@ class Move:
 
     def __init__(self, start, end, board, isEnpassantMove=False):
 
-        self.startRow = start[0]
-        self.startCol = start[1]
-        self.endRow = end[0]
-        self.endCol = end[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.moveLog = GameState().moveLog
-        self.whiteToMove = GameState().whiteToMove
-        self.board = GameState().board
+        start_row, start_col = start
+        end_row, end_col = end
+        self.startRow = start_row
+        self.startCol = start_col
+        self.endRow = end_row
+        self.endCol = end_col
+        piece_moved = self.pieceMoved = board[start_row][start_col]
+        self.pieceCaptured = board[end_row][end_col]
 
-        self.isPawnPromotion = ((self.pieceMoved == 'wp' and self.endRow == 0) or (self.pieceMoved == 'bp' and self.endRow == 7))
+        self.isPawnPromotion = ((piece_moved == 'wp' and end_row == 0) or (piece_moved == 'bp' and end_row == 7))
 
-        # self.isEnpassant = ((self.pieceMoved[1] == 'p') and ((self.endRow, self.endCol) == enpassant_possible))
         self.isEnpassantMove = isEnpassantMove
-        if self.isEnpassantMove:
-            self.pieceCaptured = 'wp' if self.pieceMoved == 'bp' else 'bp'
+        if isEnpassantMove:
+            self.pieceCaptured = 'wp' if piece_moved == 'bp' else 'bp'
 
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        # packed 12 bit id: start square in the low 6 bits, end square in the next 6 (square = row * 8 + col)
+        self.moveID = (start_row * 8 + start_col) | (end_row * 8 + end_col) << 6
 
     #equalizing objects
     def __eq__(self, other):
@@ -433,10 +889,14 @@ class Move:
             return self.moveID == other.moveID
         return False
 
+    def __hash__(self):
+        return self.moveID
+
+    def __repr__(self):
+        return "Move(" + self.get_chess_notation()[0] + ")"
+
     def get_chess_notation(self):
         return (self.get_rank_file(self.startRow, self.startCol) + self.get_rank_file(self.endRow, self.endCol), [(self.startRow, self.startCol), (self.endRow, self.endCol)])
 
     def get_rank_file(self, r, c):
         return self.cols_to_files[c] + self. rows_to_ranks[r]
-
-
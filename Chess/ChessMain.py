@@ -1,8 +1,14 @@
 # Main driver file. Handles user input and display current GameState object
 
+import argparse
+
 import pygame as p
 from const import *
-from Chess import ChessEngine
+from Chess import ChessEngine, Bitboard
+from Chess.EngineWorker import MOVES, EngineWorker, move_from_id
+
+# Posted by the engine worker's listener thread with the result dict as attributes
+ENGINE_EVENT = p.USEREVENT + 1
 
 # Load images - to be done only once to prevent lag
 def load_images():
@@ -10,21 +16,35 @@ def load_images():
     for i in pieces:
         IMAGES[i] = p.transform.scale(p.image.load('images/' + i + '.png'), (SQSIZE, SQSIZE))
 
-# Main Driver. Handle input and updates graphics
-def main():
+# Main Driver. Handle input and updates graphics.
+# Only squares that changed since the last frame are redrawn, and the loop sleeps in event.wait until
+# something happens, so an idle window uses no CPU. Legal moves and engine replies are worked out by an
+# EngineWorker process and come back as ENGINE_EVENTs. engine_colour is the side the engine plays, None for
+# two human players
+def main(engine_colour=ENGINE_COLOUR):
     p.init()
     load_images()
     screen = p.display.set_mode((HEIGHT, WIDTH))
     clock = p.time.Clock()
-    screen.fill(p.Color("white"))
-    game = ChessEngine.GameState()
-    valid_moves = game.get_valid_moves()
+    board_surface = make_board_surface()
+    game = Bitboard.BitboardGameState()
+    worker = EngineWorker(lambda result: p.event.post(p.event.Event(ENGINE_EVENT, result)))
+    worker.request_moves(game)
+    # empty until the worker answers, and while the engine is on move, so clicks cannot play a move
+    valid_moves = []
     move_made = False
     running = True
     main.sq_selected, main.player_clicks = (), []
 
+    draw_game_state(screen, game, board_surface)
+    p.display.flip()
+    # what is on screen, compared against the game after every batch of events
+    shown_board = [row[:] for row in game.board]
+    shown_selected = ()
+
     while running:
-        for e in p.event.get():
+        # block until there is input, then take everything else already queued
+        for e in [p.event.wait()] + p.event.get():
             if e.type == p.QUIT:
                 running = False
             elif e.type == p.MOUSEBUTTONDOWN:
@@ -50,22 +70,53 @@ def main():
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_u:
                     game.undo_move()
+                    # against the engine, take back its reply as well so the human is on move again
+                    if engine_to_move(game, engine_colour) and game.moveLog:
+                        game.undo_move()
                     move_made = True
                 if e.key == p.K_e:
                     running = False
+            elif e.type == ENGINE_EVENT and worker.is_current(e.dict):
+                if e.kind == MOVES:
+                    if not engine_to_move(game, engine_colour):
+                        valid_moves = [move_from_id(game, move_id) for move_id in e.moves]
+                    elif e.moves:
+                        worker.request_search(game, ENGINE_TIME)
+                elif e.move is not None:
+                    game.make_move(move_from_id(game, e.move))
+                    move_made = True
+            elif e.type == p.VIDEOEXPOSE:
+                draw_game_state(screen, game, board_surface)
+                p.display.flip()
 
         if move_made:
-            valid_moves = game.get_valid_moves()
+            # supersedes anything the worker was still doing for the previous position
+            valid_moves = []
+            worker.request_moves(game)
             move_made = False
 
+        dirty = draw_changes(screen, board_surface, game.board, shown_board, main.sq_selected, shown_selected)
+        shown_selected = main.sq_selected
+        if dirty:
+            p.display.update(dirty)
         clock.tick(MAX_FPS)
-        p.display.flip()
-        draw_game_state(screen, game)
 
-def draw_game_state(screen, game):
-    draw_board(screen)
+    worker.close()
+
+def engine_to_move(game, engine_colour):
+    return engine_colour == ('w' if game.whiteToMove else 'b')
+
+# Full redraw: the cached board then every piece
+def draw_game_state(screen, game, board_surface):
+    screen.blit(board_surface, (0, 0))
     draw_pieces(screen, game.board)
 
+# The empty board never changes, so it is drawn once and copied from afterwards
+def make_board_surface():
+    surface = p.Surface((WIDTH, HEIGHT))
+    draw_board(surface)
+    return surface
+
 def draw_board(screen):
     colours = [p.Color("#EEEED2"), p.Color("#769656")]
     for r in range(DIMENSION):
@@ -80,5 +131,27 @@ def draw_pieces(screen, board):
             if piece != "-":
                 screen.blit(IMAGES[piece], p.Rect(c*SQSIZE, r*SQSIZE, SQSIZE, SQSIZE))
 
+# Redraw the squares whose piece or selection changed, and return their rects for display.update
+def draw_changes(screen, board_surface, board, shown_board, selected, shown_selected):
+    dirty = []
+    for r in range(DIMENSION):
+        for c in range(DIMENSION):
+            reselected = selected != shown_selected and (r, c) in (selected, shown_selected)
+            if board[r][c] != shown_board[r][c] or reselected:
+                dirty.append(draw_square(screen, board_surface, board[r][c], r, c, (r, c) == selected))
+                shown_board[r][c] = board[r][c]
+    return dirty
+
+def draw_square(screen, board_surface, piece, r, c, selected):
+    rect = p.Rect(c*SQSIZE, r*SQSIZE, SQSIZE, SQSIZE)
+    screen.blit(board_surface, rect, rect)
+    if selected:
+        p.draw.rect(screen, p.Color("#BACA44"), rect)
+    if piece != "-":
+        screen.blit(IMAGES[piece], rect)
+    return rect
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Play chess in a window, against another person or the engine.")
+    parser.add_argument("--engine", choices=('w', 'b'), default=ENGINE_COLOUR, help="colour the engine plays")
+    main(parser.parse_args().engine)
@@ -0,0 +1,106 @@
+# Streaming reader for EPD (and plain FEN per line) position files.
+# The file is memory mapped and read a line at a time, so a file of any size is walked in constant memory:
+# nothing is collected into lists, and load_positions reuses a single GameState for every record.
+# Run with: python -m Chess.EPD FILE [--limit N]
+
+import argparse
+import mmap
+import sys
+
+from Chess.Backends import BACKENDS
+
+
+# Split the operations after the four position fields: 'bm e4; id "WAC.001";' -> {'bm': 'e4', 'id': 'WAC.001'}
+def parse_operations(text):
+    operations = {}
+    i, length = 0, len(text)
+    while i < length:
+        while i < length and text[i] in ' \t;':
+            i += 1
+        start = i
+        while i < length and text[i] not in ' \t;':
+            i += 1
+        opcode = text[start:i]
+        if not opcode:
+            break
+        operands = []
+        while i < length and text[i] != ';':
+            if text[i] == '"':
+                end = text.find('"', i + 1)
+                end = length if end == -1 else end
+                operands.append(text[i + 1:end])
+                i = end + 1
+            elif text[i] in ' \t':
+                i += 1
+            else:
+                start = i
+                while i < length and text[i] not in ' \t;':
+                    i += 1
+                operands.append(text[start:i])
+        operations[opcode] = ' '.join(operands)
+    return operations
+
+
+# (fen, operations) for one line. The half and full move counters come from the hmvc/fmvn operations,
+# or from the fifth and sixth fields when the line is a full FEN
+def parse_line(line):
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("EPD line %r has fewer than four fields" % line)
+    rest = fields[4] if len(fields) > 4 else ''
+    counters = rest.split(None, 2)
+    if len(counters) >= 2 and counters[0].isdigit() and counters[1].isdigit():
+        halfmove, fullmove = counters[0], counters[1]
+        operations = parse_operations(counters[2] if len(counters) > 2 else '')
+    else:
+        operations = parse_operations(rest)
+        halfmove, fullmove = operations.get('hmvc', '0'), operations.get('fmvn', '1')
+    return ' '.join(fields[:4] + [halfmove, fullmove]), operations
+
+
+# Yield (fen, operations) for every position in the file, skipping blank lines and # comments
+def read_epd(path):
+    with open(path, 'rb') as file:
+        # mmap cannot map an empty file
+        if not file.seek(0, 2):
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            while True:
+                line = data.readline()
+                if not line:
+                    break
+                line = line.decode('ascii', 'replace').strip()
+                if line and not line.startswith('#'):
+                    yield parse_line(line)
+
+
+# Yield (game, operations) with game set up for each position in turn. The same game object is reloaded
+# every time, so take what you need from it before asking for the next one
+def load_positions(path, backend='bitboard', game=None):
+    if game is None:
+        game = BACKENDS[backend]()
+    for fen, operations in read_epd(path):
+        game.load_fen(fen)
+        yield game, operations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream the positions of an EPD file and report a count.")
+    parser.add_argument("path")
+    parser.add_argument("--limit", type=int, help="stop after this many positions")
+    parser.add_argument("--show", action="store_true", help="print each position's FEN and operations")
+    args = parser.parse_args(argv)
+
+    count = 0
+    for game, operations in load_positions(args.path):
+        if args.show:
+            sys.stdout.write("%s  %r\n" % (game.get_fen(), operations))
+        count += 1
+        if args.limit is not None and count >= args.limit:
+            break
+    sys.stdout.write("%d positions\n" % count)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+# Engine work (legal moves, searches) in a separate process so the GUI never waits on it.
+# Every request gets a new id and supersedes the ones before it: the worker drops superseded requests,
+# a search in progress stops at its next node once a newer id is published through shared memory, and
+# results for old ids are never delivered. Results come back on a listener thread which hands them to
+# the on_result callback (ChessMain posts them as pygame events; this module does not import pygame).
+
+import multiprocessing
+import threading
+from array import array
+
+from Chess.Backends import BACKENDS
+from Chess.ChessEngine import Move
+from Chess.Search import SearchTimeout, Searcher
+
+MOVES = 'moves'
+SEARCH = 'search'
+
+
+# Searcher that gives up as soon as its request is no longer the latest one
+class _CancellableSearcher(Searcher):
+    def __init__(self, latest):
+        super().__init__()
+        self.latest = latest
+        self.request_id = 0
+
+    def check_limits(self):
+        if self.latest.value != self.request_id:
+            raise SearchTimeout()
+        super().check_limits()
+
+
+def _worker_main(requests, results, latest, backend):
+    game = BACKENDS[backend]()
+    searcher = _CancellableSearcher(latest)
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, kind, packed, history, time_limit = request
+        if request_id != latest.value:
+            continue
+        game.load_packed_state(packed)
+        # keys of the earlier positions, so the search sees repetitions in the game
+        game.set_history(array('Q', history))
+        if kind == MOVES:
+            result = {'moves': [move.moveID for move in game.get_valid_moves()]}
+        else:
+            searcher.request_id = request_id
+            found = searcher.search(game, time_limit=time_limit)
+            result = {'move': found.move.moveID if found.move is not None else None, 'score': found.score,
+                      'depth': found.depth}
+        if request_id == latest.value:
+            result['request_id'] = request_id
+            result['kind'] = kind
+            results.put(result)
+
+
+# Rebuild a Move of the game's current position from its moveID
+def move_from_id(game, move_id):
+    start, end = divmod(move_id & 63, 8), divmod(move_id >> 6, 8)
+    piece = game.board[start[0]][start[1]]
+    enpassant = piece[1] == 'p' and start[1] != end[1] and game.board[end[0]][end[1]] == '-'
+    return Move(start, end, game.board, enpassant)
+
+
+class EngineWorker:
+    def __init__(self, on_result, backend='bitboard'):
+        self.on_result = on_result
+        # id of the only request whose result is still wanted, read by the worker at every search node
+        self.latest = multiprocessing.Value('q', 0, lock=False)
+        self.requests = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_worker_main,
+                                               args=(self.requests, self.results, self.latest, backend), daemon=True)
+        self.process.start()
+        self.listener = threading.Thread(target=self.listen, daemon=True)
+        self.listener.start()
+
+    def listen(self):
+        while True:
+            result = self.results.get()
+            if result is None:
+                break
+            if result['request_id'] == self.latest.value:
+                self.on_result(result)
+
+    def submit(self, kind, game, time_limit=None):
+        self.latest.value += 1
+        history = array('Q', game.reversible_history()).tobytes()
+        self.requests.put((self.latest.value, kind, game.get_packed_state(), history, time_limit))
+        return self.latest.value
+
+    # Result: {'request_id', 'kind': MOVES, 'moves': [moveID, ...]}
+    def request_moves(self, game):
+        return self.submit(MOVES, game)
+
+    # Result: {'request_id', 'kind': SEARCH, 'move': moveID or None, 'score', 'depth'}
+    def request_search(self, game, time_limit):
+        return self.submit(SEARCH, game, time_limit)
+
+    # Drop whatever is queued or running
+    def cancel(self):
+        self.latest.value += 1
+
+    def is_current(self, result):
+        return result['request_id'] == self.latest.value
+
+    def close(self):
+        self.cancel()
+        self.requests.put(None)
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.results.put(None)
+        self.listener.join(1)
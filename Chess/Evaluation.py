@@ -0,0 +1,155 @@
+# Static evaluation of a GameState: material, piece-square tables, mobility and pawn structure.
+# Scores are in centipawns from the point of view of the side to move. Everything is integer arithmetic,
+# so BatchEvaluation can reproduce it exactly.
+
+from Chess.ChessEngine import KNIGHT_TARGETS, SLIDER_DIRECTIONS
+
+PIECE_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+
+# Piece-square tables from white's point of view, row 0 is the eighth rank as on GameState.board
+PIECE_SQUARE_TABLES = {
+    'p': (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ),
+    'N': (
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ),
+    'B': (
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ),
+    'R': (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0,
+    ),
+    'Q': (
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ),
+    'K': (
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20,
+    ),
+}
+
+# Material plus table value for every piece on every square, black's tables mirrored top to bottom
+SQUARE_SCORES = {}
+for _piece, _table in PIECE_SQUARE_TABLES.items():
+    SQUARE_SCORES['w' + _piece] = tuple(PIECE_VALUES[_piece] + _table[sq] for sq in range(64))
+    SQUARE_SCORES['b' + _piece] = tuple(PIECE_VALUES[_piece] + _table[(7 - sq // 8) * 8 + sq % 8] for sq in range(64))
+
+# Mobility proxy: centipawns per empty square a piece could move to (captures are not counted)
+MOBILITY_WEIGHTS = {'N': 4, 'B': 4, 'R': 2, 'Q': 1}
+
+DOUBLED_PAWN_PENALTY = 10  # per pawn beyond the first on a file
+ISOLATED_PAWN_PENALTY = 15  # per pawn with no friendly pawn on a neighbouring file
+# Passed pawn bonus by rank counted from the pawn's own side (second rank = 1)
+PASSED_PAWN_BONUS = (0, 5, 10, 20, 35, 60, 100, 0)
+
+# (row, col) squares along each direction from every square, for the sliders' mobility
+SLIDER_RAYS = {}
+for _piece, _directions in SLIDER_DIRECTIONS.items():
+    SLIDER_RAYS[_piece] = tuple(
+        tuple(tuple((sq // 8 + dr * i, sq % 8 + dc * i) for i in range(1, 8)
+                    if 0 <= sq // 8 + dr * i <= 7 and 0 <= sq % 8 + dc * i <= 7) for dr, dc in _directions)
+        for sq in range(64))
+
+
+def mobility(board, sq, kind):
+    count = 0
+    if kind == 'N':
+        for row, col in KNIGHT_TARGETS[sq]:
+            if board[row][col] == '-':
+                count += 1
+        return count
+    for ray in SLIDER_RAYS[kind][sq]:
+        for row, col in ray:
+            if board[row][col] != '-':
+                break
+            count += 1
+    return count
+
+
+# Pawn structure from white's point of view, given the squares of each side's pawns
+def pawn_structure(white_pawns, black_pawns):
+    score = 0
+    for pawns, enemies, sign in ((white_pawns, black_pawns, 1), (black_pawns, white_pawns, -1)):
+        files = [0] * 10  # padded by one file each side
+        for sq in pawns:
+            files[sq % 8 + 1] += 1
+        for count in files:
+            if count > 1:
+                score -= sign * DOUBLED_PAWN_PENALTY * (count - 1)
+        for sq in pawns:
+            row, col = divmod(sq, 8)
+            if not files[col] and not files[col + 2]:
+                score -= sign * ISOLATED_PAWN_PENALTY
+            # passed: no enemy pawn ahead of it on its own or a neighbouring file
+            for enemy in enemies:
+                if abs(enemy % 8 - col) <= 1 and (enemy // 8 < row if sign > 0 else enemy // 8 > row):
+                    break
+            else:
+                score += sign * PASSED_PAWN_BONUS[7 - row if sign > 0 else row]
+    return score
+
+
+def evaluate(game):
+    board = game.board
+    score = 0
+    sq = 0
+    white_pawns = []
+    black_pawns = []
+    for row in board:
+        for piece in row:
+            if piece != '-':
+                value = SQUARE_SCORES[piece][sq]
+                kind = piece[1]
+                if kind == 'p':
+                    (white_pawns if piece[0] == 'w' else black_pawns).append(sq)
+                elif kind != 'K':
+                    value += MOBILITY_WEIGHTS[kind] * mobility(board, sq, kind)
+                if piece[0] == 'w':
+                    score += value
+                else:
+                    score -= value
+            sq += 1
+    score += pawn_structure(white_pawns, black_pawns)
+    return score if game.whiteToMove else -score
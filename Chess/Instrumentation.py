@@ -0,0 +1,232 @@
+# Opt-in instrumentation of the engine's hot paths.
+# enable() swaps timing wrappers in for the methods in INSTRUMENTED (on GameState, BitboardGameState and Move)
+# and disable() puts the originals back, so nothing is measured, and nothing costs anything, unless it is on.
+# Set CHESS_INSTRUMENT=1 (or =memory to trace allocations too) to enable it as the Chess package is imported,
+# and CHESS_INSTRUMENT_OUT=PATH to write a snapshot at exit: JSON for a .json path, otherwise collapsed
+# stacks ("frame;frame microseconds" lines) for flamegraph.pl or speedscope.
+# Run with: python -m Chess.Instrumentation [--fen FEN] [--depth N] [--search] [--json PATH] [--collapsed PATH]
+
+import argparse
+import atexit
+import json
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+
+from Chess.ChessEngine import GameState, Move
+from Chess.Bitboard import BitboardGameState
+
+INSTRUMENTED = {
+    GameState: ('get_valid_moves', 'get_possible_moves', 'get_pins_and_checks', 'check_for_pins_and_checks',
+                'make_move', 'undo_move'),
+    BitboardGameState: ('get_valid_moves', 'make_move', 'undo_move'),
+    Move: ('__init__',),
+}
+
+# (class, name) -> original function, filled while enabled
+_originals = {}
+# label -> [calls, total seconds]
+_calls = {}
+# call stack (tuple of labels) -> seconds spent in the innermost frame itself
+_stacks = {}
+# labels of the wrapped calls in progress, and the time their callees took so far
+_stack = []
+_child_time = []
+# seconds spent counting events so far, which every timed span around the counting leaves out
+_event_time = [0.0]
+counters = {}
+
+
+def is_enabled():
+    return bool(_originals)
+
+
+def _count(name, amount=1):
+    counters[name] = counters.get(name, 0) + amount
+
+
+# events, if given, is called with the instance and the result once the call's timed span has ended
+def _wrap(label, function, events=None):
+    totals = _calls.setdefault(label, [0, 0.0])
+    perf_counter = time.perf_counter
+
+    def wrapper(*args, **kwargs):
+        _stack.append(label)
+        _child_time.append(0.0)
+        event_time = _event_time[0]
+        start = perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            elapsed = perf_counter() - start - (_event_time[0] - event_time)
+            key = tuple(_stack)
+            _stack.pop()
+            self_time = elapsed - _child_time.pop()
+            if _child_time:
+                _child_time[-1] += elapsed
+            _stacks[key] = _stacks.get(key, 0.0) + self_time
+            totals[0] += 1
+            totals[1] += elapsed
+        if events is not None:
+            start = perf_counter()
+            events(args[0], result)
+            _event_time[0] += perf_counter() - start
+        return result
+
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    wrapper.__wrapped__ = function
+    return wrapper
+
+
+# What the engine used to print: en passant squares set by make_move and en passant moves generated.
+# Counted outside the timed spans, so counting does not show up in the timings
+def _make_move_events(game, result):
+    if game.enpassant_possible:
+        _count('enpassant_squares')
+
+
+def _valid_moves_events(game, moves):
+    _count('moves_generated', len(moves))
+    for move in moves:
+        if move.isEnpassantMove:
+            _count('enpassant_moves')
+
+
+def enable(trace_memory=False):
+    if is_enabled():
+        return
+    for cls, names in INSTRUMENTED.items():
+        for name in names:
+            # only what the class defines itself; inherited methods are wrapped on the base class
+            if name not in cls.__dict__:
+                continue
+            original = cls.__dict__[name]
+            _originals[(cls, name)] = original
+            events = None
+            if name == 'make_move':
+                events = _make_move_events
+            elif name == 'get_valid_moves':
+                events = _valid_moves_events
+            setattr(cls, name, _wrap(cls.__name__ + '.' + name, original, events))
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    for (cls, name), original in _originals.items():
+        setattr(cls, name, original)
+    _originals.clear()
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    for totals in _calls.values():
+        totals[0], totals[1] = 0, 0.0
+    _stacks.clear()
+    _event_time[0] = 0.0
+    counters.clear()
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+
+def snapshot():
+    self_times = {}
+    for stack, seconds in _stacks.items():
+        self_times[stack[-1]] = self_times.get(stack[-1], 0.0) + seconds
+    functions = {}
+    for label, (calls, seconds) in sorted(_calls.items(), key=lambda item: -item[1][1]):
+        if calls:
+            functions[label] = {
+                'calls': calls,
+                'total_seconds': seconds,
+                'self_seconds': self_times.get(label, 0.0),
+                'mean_microseconds': seconds / calls * 1e6,
+            }
+    result = {
+        'enabled': is_enabled(),
+        # every move made is a node visited; the backends make their moves separately
+        'nodes': sum(_calls.get(cls.__name__ + '.make_move', (0, 0))[0] for cls in (GameState, BitboardGameState)),
+        'allocations': {'Move': _calls.get('Move.__init__', (0, 0))[0]},
+        'counters': dict(counters),
+        'functions': functions,
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        result['allocations']['traced_bytes'] = current
+        result['allocations']['peak_traced_bytes'] = peak
+    return result
+
+
+def write_json(path):
+    with open(path, 'w') as file:
+        json.dump(snapshot(), file, indent=2)
+
+
+# One line per call stack with the microseconds spent in its innermost frame, the format flamegraph.pl reads
+def write_collapsed(path):
+    with open(path, 'w') as file:
+        for stack, seconds in sorted(_stacks.items()):
+            file.write("%s %d\n" % (';'.join(stack), round(seconds * 1e6)))
+
+
+def _write_at_exit(path):
+    # worker processes inherit the environment, so each writes its own file
+    if multiprocessing.parent_process() is not None:
+        path = "%s.%d" % (path, os.getpid())
+    if path.endswith('.json'):
+        write_json(path)
+    else:
+        write_collapsed(path)
+
+
+def enable_from_environment():
+    flag = os.environ.get('CHESS_INSTRUMENT', '')
+    if flag and flag != '0':
+        enable(trace_memory=flag == 'memory')
+        if os.environ.get('CHESS_INSTRUMENT_OUT'):
+            atexit.register(_write_at_exit, os.environ['CHESS_INSTRUMENT_OUT'])
+
+
+def main(argv=None):
+    from Chess.Backends import BACKENDS
+    from Chess.Perft import load_game, perft
+    from Chess.Search import Searcher
+
+    parser = argparse.ArgumentParser(description="Run perft or a search with the engine instrumented.")
+    parser.add_argument("--fen", default="r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="bitboard")
+    parser.add_argument("--search", action="store_true", help="search to --depth instead of running perft")
+    parser.add_argument("--memory", action="store_true", help="trace allocations with tracemalloc (slow)")
+    parser.add_argument("--json", help="write the snapshot here")
+    parser.add_argument("--collapsed", help="write collapsed stacks here")
+    args = parser.parse_args(argv)
+
+    game = load_game(args.fen, args.backend)
+    enable(trace_memory=args.memory)
+    reset()
+    searcher = None
+    if args.search:
+        searcher = Searcher()
+        searcher.search(game, max_depth=args.depth)
+    else:
+        perft(game, args.depth)
+
+    if args.json:
+        write_json(args.json)
+    if args.collapsed:
+        write_collapsed(args.collapsed)
+    result = snapshot()
+    if searcher is not None:
+        result['move_ordering'] = searcher.ordering.stats()
+    sys.stdout.write(json.dumps(result, indent=2) + "\n")
+    disable()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
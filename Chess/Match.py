@@ -0,0 +1,301 @@
+# Engine against engine matches over a process pool, for checking that a change makes the engine stronger.
+# Each opening is played twice with colours reversed. Finished games are appended to a PGN file as they come
+# in (nothing is kept once written), and after every game the running Elo difference of the engine over the
+# baseline and the SPRT log likelihood ratio are printed. Throughput and peak memory are reported at the end.
+# Engines are given as comma separated options: depth=N, nodes=N, time=SECONDS, hash=MB, eval=MODULE:FUNCTION.
+# Run with: python -m Chess.Match [--games N] [--workers N] [--engine SPEC] [--baseline SPEC] [--openings FILE]
+#                                 [--pgn PATH] [--archive PATH] [--elo0 E] [--elo1 E] [--stop-on-sprt]
+
+import argparse
+import importlib
+import math
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from Chess.Archive import ArchiveWriter, encode_game
+from Chess.Backends import BACKENDS
+from Chess.ChessEngine import START_FEN
+from Chess.EPD import read_epd
+from Chess.PGN import format_game, san
+from Chess.Search import Searcher
+from Chess.TranspositionTable import TranspositionTable
+from Chess.UCI import find_move
+
+# Short openings as moves from the start position, so the PGN shows them
+OPENINGS = [
+    "e2e4 e7e5 g1f3 b8c6",
+    "e2e4 c7c5 g1f3 d7d6",
+    "e2e4 e7e6 d2d4 d7d5",
+    "e2e4 c7c6 d2d4 d7d5",
+    "d2d4 d7d5 c2c4 e7e6",
+    "d2d4 g8f6 c2c4 g7g6",
+    "c2c4 e7e5 b1c3 g8f6",
+    "g1f3 d7d5 g2g3 g8f6",
+]
+
+ENGINE_OPTIONS = {'depth': int, 'nodes': int, 'time': float, 'hash': int, 'eval': str}
+DEFAULT_NODES = 5000
+# games still going at this many plies are given as draws
+MAX_PLIES = 300
+
+
+# 'depth=4,hash=32' -> {'depth': 4, 'hash': 32, ...}. With no depth, node or time limit a node limit is used
+def parse_engine(text):
+    spec = {'depth': None, 'nodes': None, 'time': None, 'hash': 16, 'eval': 'Chess.Evaluation:evaluate'}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, _, value = item.partition('=')
+        name = name.strip()
+        if name not in ENGINE_OPTIONS:
+            raise ValueError("unknown engine option %r (expected one of %s)" % (name, ', '.join(ENGINE_OPTIONS)))
+        spec[name] = ENGINE_OPTIONS[name](value.strip())
+    if spec['depth'] is None and spec['nodes'] is None and spec['time'] is None:
+        spec['nodes'] = DEFAULT_NODES
+    return spec
+
+
+def _load_function(path):
+    module, _, name = path.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+# (fen, [uci moves]) for every opening: the built in list, or the positions of an EPD/FEN file
+def load_openings(path=None):
+    if path is None:
+        return [(START_FEN, opening.split()) for opening in OPENINGS]
+    return [(fen, []) for fen, operations in read_epd(path)]
+
+
+# Largest resident set of this process so far, in megabytes
+def peak_memory():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+# (result, termination) if the game is over, None otherwise. moves are the position's legal moves
+def game_over(game, moves):
+    if not moves:
+        if game.in_check:
+            return ('0-1' if game.whiteToMove else '1-0'), 'checkmate'
+        return '1/2-1/2', 'stalemate'
+    if game.repetitions(2) >= 2:
+        return '1/2-1/2', 'threefold repetition'
+    if game.get_halfmove_clock() >= 100:
+        return '1/2-1/2', 'fifty move rule'
+    pieces = [piece for row in game.board for piece in row if piece != '-' and piece[1] != 'K']
+    if not pieces or (len(pieces) == 1 and pieces[0][1] in 'NB'):
+        return '1/2-1/2', 'insufficient material'
+    return None
+
+
+def _play_game(task):
+    number, (fen, opening), specs, names, backend, max_plies, archive = task
+    game = BACKENDS[backend](fen)
+    black_first = not game.whiteToMove
+    first_move_number = game.get_fullmove_number()
+    sans = []
+    for text in opening:
+        move = find_move(game, text)
+        if move is None:
+            raise ValueError("opening move %s is not legal in %s" % (text, game.get_fen()))
+        sans.append(san(game, move))
+        game.make_move(move)
+
+    # one searcher per side for the whole game, so each keeps its own hash table between moves
+    searchers = {}
+    for colour, spec in zip('wb', specs):
+        searchers[colour] = (Searcher(evaluate=_load_function(spec['eval']), tt=TranspositionTable(spec['hash'])), spec)
+    while True:
+        moves = game.get_valid_moves()
+        outcome = game_over(game, moves)
+        if outcome is None and len(sans) >= max_plies:
+            outcome = '1/2-1/2', 'adjudication'
+        if outcome is not None:
+            break
+        searcher, spec = searchers['w' if game.whiteToMove else 'b']
+        found = searcher.search(game, max_depth=spec['depth'] or 64, time_limit=spec['time'],
+                                node_limit=spec['nodes'])
+        sans.append(san(game, found.move, moves))
+        game.make_move(found.move)
+
+    result, termination = outcome
+    return {'number': number, 'fen': fen, 'white': names[0], 'black': names[1], 'sans': sans, 'result': result,
+            'termination': termination, 'black_first': black_first, 'first_move_number': first_move_number,
+            'archive': encode_game(game, result) if archive else None, 'peak_memory': peak_memory()}
+
+
+def _pgn(record, event):
+    headers = [('Event', event), ('Site', '?'), ('Date', time.strftime('%Y.%m.%d')), ('Round', record['number']),
+               ('White', record['white']), ('Black', record['black']), ('Result', record['result'])]
+    if record['fen'] != START_FEN:
+        headers += [('SetUp', '1'), ('FEN', record['fen'])]
+    headers += [('PlyCount', len(record['sans'])), ('Termination', record['termination'])]
+    return format_game(headers, record['sans'], record['result'], record['black_first'], record['first_move_number'])
+
+
+def _elo(score):
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return -400 * math.log10(1 / score - 1)
+
+
+def _expected_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+# Mean score and per game variance of a win/draw/loss record
+def _score_and_variance(wins, draws, losses):
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    return score, variance
+
+
+# Elo difference and its 95% error margin for a win/draw/loss record
+def elo_difference(wins, draws, losses):
+    games = wins + draws + losses
+    if not games:
+        return 0.0, math.inf
+    score, variance = _score_and_variance(wins, draws, losses)
+    if score <= 0 or score >= 1:
+        return _elo(score), math.inf
+    margin = 1.96 * math.sqrt(variance / games)
+    return _elo(score), (_elo(score + margin) - _elo(score - margin)) / 2
+
+
+# Log likelihood ratio of "elo1 better" against "elo0 better" for the record (the normal approximation used
+# by fishtest's simplified SPRT)
+def sprt_llr(wins, draws, losses, elo0, elo1):
+    games = wins + draws + losses
+    if not games:
+        return 0.0
+    score, variance = _score_and_variance(wins, draws, losses)
+    if variance == 0:
+        return 0.0
+    score0, score1 = _expected_score(elo0), _expected_score(elo1)
+    return games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+
+# (lower, upper) LLR bounds: below lower accept elo0, above upper accept elo1
+def sprt_bounds(alpha, beta):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+# Play games (each opening twice, colours reversed) and stream them to pgn_path, and to a binary archive
+# (Chess.Archive) at archive_path if one is given. engine and baseline are (name, spec) pairs; results are
+# counted from the engine's side. Returns (wins, draws, losses)
+def run_match(engine, baseline, openings, games, workers=None, pgn_path='match.pgn', backend='bitboard',
+              max_plies=MAX_PLIES, sprt=(0.0, 5.0, 0.05, 0.05), stop_on_sprt=False, out=sys.stdout,
+              archive_path=None):
+    workers = workers or os.cpu_count() or 1
+    elo0, elo1, alpha, beta = sprt
+    lower, upper = sprt_bounds(alpha, beta)
+    event = "%s vs %s" % (engine[0], baseline[0])
+
+    def tasks():
+        for number in range(games):
+            opening = openings[number // 2 % len(openings)]
+            first, second = (engine, baseline) if number % 2 == 0 else (baseline, engine)
+            yield (number + 1, opening, (first[1], second[1]), (first[0], second[0]), backend, max_plies,
+                   archive_path is not None)
+
+    wins = draws = losses = 0
+    worker_memory = 0.0
+    start = time.perf_counter()
+    pending = set()
+    queued = tasks()
+    decided = None
+    archive = ArchiveWriter(archive_path) if archive_path is not None else None
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(pgn_path, 'w') as pgn:
+        # only a couple of games per worker are queued at a time, however long the match
+        for task in queued:
+            pending.add(pool.submit(_play_game, task))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                record = future.result()
+                pgn.write(_pgn(record, event))
+                pgn.flush()
+                if archive is not None:
+                    archive.write_record(*record['archive'])
+                worker_memory = max(worker_memory, record['peak_memory'] or 0.0)
+                if record['result'] == '1/2-1/2':
+                    draws += 1
+                elif (record['result'] == '1-0') == (record['white'] == engine[0]):
+                    wins += 1
+                else:
+                    losses += 1
+
+                elo, margin = elo_difference(wins, draws, losses)
+                llr = sprt_llr(wins, draws, losses, elo0, elo1)
+                if decided is None and (llr <= lower or llr >= upper):
+                    decided = 'H0 (elo0 %.1f)' % elo0 if llr <= lower else 'H1 (elo1 %.1f)' % elo1
+                out.write("games %d  +%d =%d -%d  elo %.1f +/- %.1f  LLR %.2f (%.2f, %.2f)%s\n" % (
+                    wins + draws + losses, wins, draws, losses, elo, margin, llr, lower, upper,
+                    "  accepted " + decided if decided else ""))
+                out.flush()
+
+            # the games already started are finished and counted when the test is stopped early
+            if not (stop_on_sprt and decided):
+                for task in queued:
+                    pending.add(pool.submit(_play_game, task))
+                    if len(pending) >= 2 * workers:
+                        break
+
+    if archive is not None:
+        archive.close()
+    elapsed = time.perf_counter() - start
+    played = wins + draws + losses
+    rate = played * 3600 / elapsed / workers if elapsed > 0 else 0.0
+    out.write("%d games in %.1fs on %d workers: %.0f games/hour/core\n" % (played, elapsed, workers, rate))
+    main_memory = peak_memory()
+    if main_memory is not None:
+        out.write("peak memory: main process %.1f MB, largest worker %.1f MB\n" % (main_memory, worker_memory))
+    return wins, draws, losses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play the engine against a baseline and test the Elo difference.")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, help="processes to play in (default: one per core)")
+    parser.add_argument("--engine", default="", help="options of the engine being tested, e.g. depth=3,hash=32")
+    parser.add_argument("--baseline", default="", help="options of the engine it is compared with")
+    parser.add_argument("--openings", help="EPD or FEN per line file of start positions (default: built in)")
+    parser.add_argument("--pgn", default="match.pgn", help="file the games are written to as they finish")
+    parser.add_argument("--archive", help="also write the games to this binary archive (see Chess.Archive)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="bitboard")
+    parser.add_argument("--max-plies", type=int, default=MAX_PLIES, help="adjudicate a draw after this many plies")
+    parser.add_argument("--elo0", type=float, default=0.0)
+    parser.add_argument("--elo1", type=float, default=5.0)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--stop-on-sprt", action="store_true", help="stop starting games once the SPRT decides")
+    args = parser.parse_args(argv)
+
+    engine = ("engine " + args.engine).strip(), parse_engine(args.engine)
+    baseline = ("baseline " + args.baseline).strip(), parse_engine(args.baseline)
+    openings = load_openings(args.openings)
+    if not openings:
+        parser.error("no openings in %s" % args.openings)
+    run_match(engine, baseline, openings, args.games, args.workers, args.pgn, args.backend, args.max_plies,
+              (args.elo0, args.elo1, args.alpha, args.beta), args.stop_on_sprt, archive_path=args.archive)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# Move ordering for the search: which moves of a node are tried first.
+# Moves come in stages, each generated only once the one before is used up: the hash move, captures by MVV-LVA,
+# non-capturing promotions, then quiet moves. Quiet moves are ordered by the killer moves of the ply (quiet moves
+# that caused a cutoff at the same ply elsewhere in the tree), the counter move to the opponent's last move,
+# and the butterfly history score of their from/to squares.
+# The tables are flat arrays indexed by moveID (from square | to square << 6) per side, allocated once.
+# Counts of where in the move list cutoffs happen measure how good the ordering is.
+
+from array import array
+
+from Chess.ChessEngine import CAPTURES, PROMOTIONS, QUIETS, mvv_lva
+
+MOVE_IDS = 4096
+# killer slots are kept for this many plies from the root
+MAX_PLY = 128
+KILLERS_PER_PLY = 2
+NO_MOVE = -1
+# history scores are halved when one passes this (and penalties stop at minus this), so they stay well below
+# the killer and counter move scores
+HISTORY_LIMIT = 1 << 20
+KILLER_SCORE = 1 << 30
+COUNTER_SCORE = KILLER_SCORE - 1
+
+
+class MoveOrdering:
+    def __init__(self):
+        self.killers = array('i', [NO_MOVE]) * (MAX_PLY * KILLERS_PER_PLY)
+        # [side * MOVE_IDS + moveID], side 0 for white
+        self.history = array('l', bytes(array('l').itemsize * 2 * MOVE_IDS))
+        # [side * MOVE_IDS + opponent's last moveID] -> the quiet move that refuted it last
+        self.counters = array('i', [NO_MOVE]) * (2 * MOVE_IDS)
+        self.reset_stats()
+
+    def reset_stats(self):
+        # nodes that ended in a cutoff, how many of those cut on the first move, and the sum of the cutoff indexes
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.cutoff_index_total = 0
+
+    # Forget the killers, which belong to the last search's plies, and age the history so recent results count
+    # for more. The statistics are per search too
+    def new_search(self):
+        killers = self.killers
+        for i in range(len(killers)):
+            killers[i] = NO_MOVE
+        history = self.history
+        for i in range(len(history)):
+            history[i] >>= 1
+        self.reset_stats()
+
+    def clear(self):
+        self.new_search()
+        for i in range(len(self.history)):
+            self.history[i] = 0
+        for i in range(len(self.counters)):
+            self.counters[i] = NO_MOVE
+
+    # Legal moves of the position, best guesses first. Stages are generated lazily, so a cutoff on the hash move
+    # or a capture never generates the quiet moves
+    def moves(self, game, hash_move_id=NO_MOVE, ply=0):
+        if hash_move_id >= 0:
+            start = hash_move_id & 63
+            for move in game.get_valid_moves_from(start // 8, start % 8):
+                if move.moveID == hash_move_id:
+                    yield move
+                    break
+            else:
+                hash_move_id = NO_MOVE
+        captures = game.get_valid_moves(CAPTURES)
+        captures.sort(key=mvv_lva, reverse=True)
+        for move in captures:
+            if move.moveID != hash_move_id:
+                yield move
+        for move in game.get_valid_moves(PROMOTIONS):
+            if move.moveID != hash_move_id:
+                yield move
+
+        quiets = game.get_valid_moves(QUIETS)
+        side = 0 if game.whiteToMove else MOVE_IDS
+        killer_base = ply * KILLERS_PER_PLY if ply < MAX_PLY else None
+        first_killer = self.killers[killer_base] if killer_base is not None else NO_MOVE
+        second_killer = self.killers[killer_base + 1] if killer_base is not None else NO_MOVE
+        counter = self.counters[side + game.moveLog[-1].moveID] if game.moveLog else NO_MOVE
+        history = self.history
+
+        def score(move):
+            move_id = move.moveID
+            if move_id == first_killer:
+                return KILLER_SCORE + 1
+            if move_id == second_killer:
+                return KILLER_SCORE
+            if move_id == counter:
+                return COUNTER_SCORE
+            return history[side + move_id]
+
+        quiets.sort(key=score, reverse=True)
+        for move in quiets:
+            if move.moveID != hash_move_id:
+                yield move
+
+    # move caused a beta cutoff as the index-th move tried (from 0) at this ply. quiets_tried are the quiet moves
+    # searched before it, which lose history for not cutting
+    def cutoff(self, game, move, ply, depth, index, quiets_tried=()):
+        self.cutoffs += 1
+        self.cutoff_index_total += index
+        if index == 0:
+            self.first_move_cutoffs += 1
+        if move.pieceCaptured != '-' or move.isPawnPromotion:
+            return
+
+        move_id = move.moveID
+        if ply < MAX_PLY:
+            killer_base = ply * KILLERS_PER_PLY
+            if self.killers[killer_base] != move_id:
+                self.killers[killer_base + 1] = self.killers[killer_base]
+                self.killers[killer_base] = move_id
+        # game is at the node, so the side to move made the cutoff and moveLog[-1] is what it answered
+        side = 0 if game.whiteToMove else MOVE_IDS
+        if game.moveLog:
+            self.counters[side + game.moveLog[-1].moveID] = move_id
+
+        history = self.history
+        bonus = depth * depth
+        history[side + move_id] += bonus
+        for tried in quiets_tried:
+            history[side + tried.moveID] = max(history[side + tried.moveID] - bonus, -HISTORY_LIMIT)
+        if history[side + move_id] > HISTORY_LIMIT:
+            for i in range(len(history)):
+                history[i] //= 2
+
+    # Share of cutoffs made by the first move tried, 1.0 for perfect ordering
+    def first_move_cutoff_rate(self):
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    # Mean position of the cutoff move in the move list, 0.0 for perfect ordering
+    def average_cutoff_index(self):
+        return self.cutoff_index_total / self.cutoffs if self.cutoffs else 0.0
+
+    def stats(self):
+        return {
+            'cutoffs': self.cutoffs,
+            'first_move_cutoffs': self.first_move_cutoffs,
+            'first_move_cutoff_rate': self.first_move_cutoff_rate(),
+            'average_cutoff_index': self.average_cutoff_index(),
+        }
@@ -0,0 +1,65 @@
+# Standard algebraic notation and PGN text for games played with GameState and Move.
+# Only what the engine plays can be written: no castling, and promotions are always to a queen.
+
+
+# SAN of a legal move in the game's current position. moves is the position's legal move list, passed in
+# when the caller already has it. The game is left as it was (the move is made and undone to find checks)
+def san(game, move, moves=None):
+    if moves is None:
+        moves = game.get_valid_moves()
+    piece = move.pieceMoved[1]
+    target = move.get_rank_file(move.endRow, move.endCol)
+    if piece == 'p':
+        text = (move.cols_to_files[move.startCol] + 'x' if move.pieceCaptured != '-' else '') + target
+        if move.isPawnPromotion:
+            text += '=Q'
+    else:
+        # the other pieces of the same kind that could also go there decide how much of the start square is needed
+        rivals = [other for other in moves if other.pieceMoved == move.pieceMoved and other.endRow == move.endRow
+                  and other.endCol == move.endCol and other.moveID != move.moveID]
+        origin = ''
+        if rivals:
+            if all(other.startCol != move.startCol for other in rivals):
+                origin = move.cols_to_files[move.startCol]
+            elif all(other.startRow != move.startRow for other in rivals):
+                origin = move.rows_to_ranks[move.startRow]
+            else:
+                origin = move.get_rank_file(move.startRow, move.startCol)
+        text = piece + origin + ('x' if move.pieceCaptured != '-' else '') + target
+
+    game.make_move(move)
+    replies = game.get_valid_moves()
+    if game.in_check:
+        text += '+' if replies else '#'
+    game.undo_move()
+    return text
+
+
+# PGN text of one game: headers is a list of (name, value) pairs (the seven tag roster first, by convention),
+# sans the moves in SAN from the position in the FEN header (or the start position), result '1-0', '0-1',
+# '1/2-1/2' or '*'. Movetext lines are kept under 80 characters
+def format_game(headers, sans, result, black_first=False, first_move_number=1):
+    lines = ['[%s "%s"]' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in headers]
+    lines.append('')
+    tokens = []
+    number = first_move_number
+    for ply, text in enumerate(sans):
+        white = (ply % 2 == 0) != black_first
+        if white:
+            tokens.append('%d.' % number)
+        elif ply == 0:
+            tokens.append('%d...' % number)
+        tokens.append(text)
+        if not white:
+            number += 1
+    tokens.append(result)
+
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) >= 80:
+            lines.append(line)
+            line = token
+        else:
+            line = line + ' ' + token if line else token
+    lines.append(line)
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,123 @@
+# Root-split perft and search over a process pool.
+# The root moves from get_valid_moves are handed out one per task. Each task carries the packed position
+# (GameState.get_packed_state) and a move id rather than pickled GameState/Move objects, and results are
+# gathered in root move order so they come out the same however the work was scheduled.
+# Every search task gets a Searcher of its own with a small transposition table, so its result depends only on the
+# task and not on which tasks its worker ran before.
+
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from Chess.Backends import BACKENDS
+from Chess.Perft import perft
+from Chess.Search import INFINITY, SearchResult, SearchTimeout, Searcher, is_mate_score, mvv_lva
+from Chess.TranspositionTable import TranspositionTable
+
+# transposition table of each search task
+TASK_HASH_MEGABYTES = 1
+
+
+def _load(packed, backend, history=b''):
+    game = BACKENDS[backend]()
+    game.load_packed_state(packed)
+    # keys of the positions before the root, so repetitions are seen as in the parent process
+    game.set_history(array('Q', history))
+    return game
+
+
+def _find_move(game, move_id):
+    for move in game.get_valid_moves():
+        if move.moveID == move_id:
+            return move
+    raise ValueError("move id %d is not legal in the packed position" % move_id)
+
+
+def _perft_task(task):
+    packed, backend, move_id, depth = task
+    game = _load(packed, backend)
+    game.make_move(_find_move(game, move_id))
+    return perft(game, depth - 1)
+
+
+# Score of one root move within the (alpha, beta) window, from the root side's point of view
+def _search_task(task):
+    packed, backend, history, move_id, depth, alpha, beta, node_limit, hash_megabytes = task
+    game = _load(packed, backend, history)
+    searcher = Searcher(tt=TranspositionTable(hash_megabytes))
+    game.make_move(_find_move(game, move_id))
+    searcher.node_limit = node_limit
+    try:
+        score = -searcher.negamax(game, depth - 1, -beta, -alpha, 1)
+    except SearchTimeout:
+        score = None
+    return score, searcher.nodes
+
+
+# Node count below each root move, like Perft.divide, with the subtrees counted in worker processes
+def parallel_divide(game, depth, workers=None, backend='bitboard'):
+    moves = game.get_valid_moves()
+    if depth <= 1:
+        return [(move, 1) for move in moves]
+    packed = game.get_packed_state()
+    tasks = [(packed, backend, move.moveID, depth) for move in moves]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        counts = list(pool.map(_perft_task, tasks))
+    return list(zip(moves, counts))
+
+
+def parallel_perft(game, depth, workers=None, backend='bitboard'):
+    if depth == 0:
+        return 1
+    return sum(count for move, count in parallel_divide(game, depth, workers, backend))
+
+
+# Iterative deepening like Searcher.search, with the root moves of each depth split over the pool. The root order
+# is Searcher.search's: MVV-LVA, then the best move of each finished depth moved to the front. That first move is
+# searched alone with a full window, the others together with a null window just above its score, and those that
+# fail high again with its score as alpha. The best move is the first in root order with the highest score, so
+# ties go the way they do in the serial search. Stops early on a mate score, as Searcher.search does.
+# node_limit applies per task; moves that run out of nodes are ignored.
+def parallel_search(game, depth, workers=None, backend='bitboard', node_limit=None,
+                    hash_megabytes=TASK_HASH_MEGABYTES):
+    start = time.perf_counter()
+    moves = game.get_valid_moves()
+    if not moves:
+        return Searcher(tt=TranspositionTable(1)).search(game, max_depth=1)
+    moves.sort(key=mvv_lva, reverse=True)
+    packed = game.get_packed_state()
+    history = array('Q', game.reversible_history()).tobytes()
+    result = SearchResult(moves[0], 0, 0, 0, 0.0)
+    nodes = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        def run(searched, iteration, alpha, beta):
+            nonlocal nodes
+            tasks = [(packed, backend, history, move.moveID, iteration, alpha, beta, node_limit, hash_megabytes)
+                     for move in searched]
+            scores = []
+            for score, task_nodes in pool.map(_search_task, tasks):
+                nodes += task_nodes
+                scores.append(score)
+            return scores
+
+        for iteration in range(1, depth + 1):
+            first_score = run(moves[:1], iteration, -INFINITY, INFINITY)[0]
+            if first_score is None:
+                break
+            best_move, best_score = moves[0], first_score
+            rest = moves[1:]
+            raised = [move for move, score in zip(rest, run(rest, iteration, best_score, best_score + 1))
+                      if score is not None and score > best_score]
+            # results come back in root order; only a strictly higher score displaces an earlier move
+            for move, score in zip(raised, run(raised, iteration, first_score, INFINITY)):
+                if score is not None and score > best_score:
+                    best_move, best_score = move, score
+            result = SearchResult(best_move, best_score, iteration, nodes, 0.0)
+            if is_mate_score(best_score):
+                break
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+
+    result.nodes = nodes
+    result.elapsed = time.perf_counter() - start
+    return result
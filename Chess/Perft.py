@@ -0,0 +1,145 @@
+# Perft: counts the leaf nodes of the legal move tree to a fixed depth.
+# Checks move generation against published totals and measures its speed (nodes per second).
+# Run with: python -m Chess.Perft [--fen FEN] [--depth N] [--divide] [--backend mailbox|bitboard] [--workers N]
+
+import argparse
+import sys
+import time
+
+from Chess.Backends import BACKENDS
+
+# (name, fen, known node counts by depth). Castling and under-promotion are not supported by the engine,
+# so only positions and depths where neither can occur are listed.
+REFERENCE_POSITIONS = [
+    ("start", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+    ("illegal ep, horizontal pin", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",
+     {1: 18, 2: 92, 3: 1670, 4: 10138, 5: 185429}),
+    ("illegal ep, diagonal pin", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1",
+     {1: 13, 2: 102, 3: 1266, 4: 10276, 5: 135655}),
+    ("ep captures checker", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1",
+     {1: 15, 2: 126, 3: 1928, 4: 13931}),
+    ("ep gives check", "8/5bk1/8/2Pp4/8/1K6/8/8 w - d6 0 1",
+     {1: 8, 2: 104, 3: 736, 4: 9287}),
+    ("double check", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1",
+     {1: 37, 2: 183, 3: 6559, 4: 23527}),
+]
+
+# Move orders reaching the same position, which must get the same position key. The en passant file is only
+# part of the key when a capture is there to be made, so a double push on the way does not matter
+TRANSPOSITIONS = [
+    ("d2d4 e7e6 c2c4 d7d5", "c2c4 d7d5 d2d4 e7e6"),
+    ("e2e4 e7e5 g1f3 b8c6", "g1f3 b8c6 e2e4 e7e5"),
+    ("e2e4 e7e5", "e2e3 e7e6 e3e4 e6e5"),
+]
+
+
+def perft(game, depth):
+    if depth == 0:
+        return 1
+    moves = game.get_valid_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        game.make_move(move)
+        nodes += perft(game, depth - 1)
+        game.undo_move()
+    return nodes
+
+
+# Node count below each root move, in get_valid_moves order
+def divide(game, depth):
+    results = []
+    for move in game.get_valid_moves():
+        game.make_move(move)
+        results.append((move, perft(game, depth - 1)))
+        game.undo_move()
+    return results
+
+
+def load_game(fen, backend='bitboard'):
+    game = BACKENDS[backend]()
+    game.load_fen(fen)
+    return game
+
+
+def run_position(name, fen, depth, backend, show_divide, expected=None, out=sys.stdout, workers=0):
+    game = load_game(fen, backend)
+    start = time.perf_counter()
+    if workers:
+        from Chess.Parallel import parallel_divide
+        results = parallel_divide(game, depth, workers, backend)
+        nodes = sum(count for move, count in results)
+    elif show_divide:
+        results = divide(game, depth)
+        nodes = sum(count for move, count in results)
+    else:
+        nodes = perft(game, depth)
+    elapsed = time.perf_counter() - start
+
+    if show_divide:
+        for move, count in results:
+            out.write("  %s: %d\n" % (move.get_chess_notation()[0], count))
+    nps = nodes / elapsed if elapsed > 0 else 0.0
+    status = ""
+    passed = True
+    if expected is not None:
+        passed = nodes == expected
+        status = "  ok" if passed else "  FAIL (expected %d)" % expected
+    out.write("%-28s depth %d  nodes %10d  time %7.3fs  nps %9.0f%s\n" % (name, depth, nodes, elapsed, nps, status))
+    return passed
+
+
+def play(game, moves):
+    for text in moves.split():
+        game.make_move(next(move for move in game.get_valid_moves() if move.get_chess_notation()[0] == text))
+    return game
+
+
+# Both move orders of each TRANSPOSITIONS pair give the same key, and the incrementally updated key agrees
+# with the one computed from scratch and the one of the position loaded from its FEN
+def check_transpositions(backend, out=sys.stdout):
+    passed = True
+    for first, second in TRANSPOSITIONS:
+        games = [play(BACKENDS[backend](), moves) for moves in (first, second)]
+        keys = {game.position_key for game in games}
+        keys.update(game.compute_zobrist_key() for game in games)
+        keys.update(load_game(game.get_fen(), backend).position_key for game in games)
+        ok = len(keys) == 1
+        passed = passed and ok
+        out.write("%-28s %s\n" % ("keys " + first, "ok" if ok else "FAIL (%d different keys)" % len(keys)))
+    return passed
+
+
+def run_suite(max_depth, backend, show_divide, out=sys.stdout, workers=0):
+    passed = check_transpositions(backend, out)
+    for name, fen, known in REFERENCE_POSITIONS:
+        depth = min(max_depth, max(known))
+        passed = run_position(name, fen, depth, backend, show_divide, known[depth], out, workers) and passed
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count move tree leaves to check and time move generation.")
+    parser.add_argument("--fen", help="position to run instead of the reference suite")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="show the node count below each root move")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="bitboard")
+    parser.add_argument("--expect", type=int, help="known node count for --fen")
+    parser.add_argument("--workers", type=int, default=0, help="split the root moves over this many processes")
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        passed = run_position("fen", args.fen, args.depth, args.backend, args.divide, args.expect, workers=args.workers)
+    else:
+        passed = run_suite(args.depth, args.backend, args.divide, workers=args.workers)
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+# Negamax alpha-beta search with iterative deepening and a capture-only quiescence search.
+# Drives any GameState through get_valid_moves/make_move/undo_move and stops on a hard time or node budget.
+
+import time
+
+from Chess.ChessEngine import CAPTURES, PROMOTIONS, mvv_lva
+from Chess.Evaluation import evaluate
+from Chess.MoveOrdering import MoveOrdering
+from Chess.TranspositionTable import EXACT, LOWER, UPPER, TranspositionTable
+
+CHECKMATE = 100000
+INFINITY = 1000000
+MAX_DEPTH = 64
+# Mate scores lie within this many plies of CHECKMATE: the search depth plus the longest tablebase mate
+MATE_PLIES = MAX_DEPTH + 254
+
+
+# Raised inside the tree when the budget runs out; the search unwinds to the root and undoes its moves
+class SearchTimeout(Exception):
+    pass
+
+
+class SearchResult:
+    def __init__(self, move, score, depth, nodes, elapsed):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return "SearchResult(move=%r, score=%d, depth=%d, nodes=%d, elapsed=%.3f)" % (
+            self.move, self.score, self.depth, self.nodes, self.elapsed)
+
+
+def is_mate_score(score):
+    return abs(score) >= CHECKMATE - MATE_PLIES
+
+
+# Mate scores are stored relative to the position rather than the root, so they stay right wherever it recurs
+def score_to_tt(score, ply):
+    if is_mate_score(score):
+        return score + ply if score > 0 else score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if is_mate_score(score):
+        return score - ply if score > 0 else score + ply
+    return score
+
+
+class Searcher:
+    def __init__(self, evaluate=evaluate, tt=None, tablebases=None):
+        self.evaluate = evaluate
+        self.tt = tt if tt is not None else TranspositionTable()
+        # Tablebase.Tablebases probed at every node below the root, None to search endings out
+        self.tablebases = tablebases
+        # killer, history and counter move tables, kept between searches
+        self.ordering = MoveOrdering()
+        self.nodes = 0
+        self.deadline = None
+        self.node_limit = None
+        self.stop_requested = False
+
+    # Ask a running search to return as soon as possible, safe to call from another thread
+    def stop(self):
+        self.stop_requested = True
+
+    def check_limits(self):
+        if self.stop_requested or (self.node_limit is not None and self.nodes >= self.node_limit) or \
+                (self.deadline is not None and time.perf_counter() >= self.deadline):
+            raise SearchTimeout()
+
+    # Iterative deepening to max_depth or until time_limit (seconds) or node_limit runs out.
+    # info is called with a SearchResult after every completed depth
+    def search(self, game, max_depth=MAX_DEPTH, time_limit=None, node_limit=None, info=None):
+        start = time.perf_counter()
+        self.nodes = 0
+        self.deadline = start + time_limit if time_limit is not None else None
+        self.node_limit = node_limit
+        self.stop_requested = False
+        self.tt.new_search()
+        self.ordering.new_search()
+        root_length = len(game.moveLog)
+
+        moves = game.get_valid_moves()
+        if not moves:
+            score = -CHECKMATE if game.in_check else 0
+            return SearchResult(None, score, 0, 0, time.perf_counter() - start)
+        moves.sort(key=mvv_lva, reverse=True)
+        result = SearchResult(moves[0], 0, 0, 0, 0.0)
+
+        for depth in range(1, max_depth + 1):
+            best_move, best_score = None, -INFINITY
+            try:
+                for move in moves:
+                    game.make_move(move)
+                    score = -self.negamax(game, depth - 1, -INFINITY, -best_score, 1)
+                    game.undo_move()
+                    if score > best_score:
+                        best_move, best_score = move, score
+            except SearchTimeout:
+                while len(game.moveLog) > root_length:
+                    game.undo_move()
+                # the previous best move is searched first, so whatever beat it at the unfinished depth is sound
+                if best_move is not None:
+                    result = SearchResult(best_move, best_score, result.depth, self.nodes, time.perf_counter() - start)
+                break
+            result = SearchResult(best_move, best_score, depth, self.nodes, time.perf_counter() - start)
+            self.tt.store(game.position_key, depth, EXACT, score_to_tt(best_score, 0), best_move.moveID)
+            if info is not None:
+                info(result)
+            if is_mate_score(best_score):
+                break
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def negamax(self, game, depth, alpha, beta, ply):
+        self.nodes += 1
+        self.check_limits()
+        if game.repetitions(1):
+            return 0
+        if self.tablebases is not None:
+            entry = self.tablebases.probe(game)
+            if entry is not None:
+                wdl, dtm = entry
+                return 0 if not wdl else (CHECKMATE - ply - dtm if wdl > 0 else -CHECKMATE + ply + dtm)
+        if depth <= 0:
+            return self.quiescence(game, alpha, beta, ply)
+
+        key = game.position_key
+        hash_move_id = -1
+        entry = self.tt.probe(key)
+        if entry is not None:
+            tt_depth, bound, tt_score, hash_move_id = entry
+            if tt_depth >= depth:
+                tt_score = score_from_tt(tt_score, ply)
+                if bound == EXACT or (bound == LOWER and tt_score >= beta) or (bound == UPPER and tt_score <= alpha):
+                    return tt_score
+
+        original_alpha = alpha
+        best_score, best_move = -INFINITY, None
+        quiets_tried = []
+        # staged generation: a cutoff on the hash move or a capture skips generating the quiet moves
+        for index, move in enumerate(self.ordering.moves(game, hash_move_id, ply)):
+            game.make_move(move)
+            score = -self.negamax(game, depth - 1, -beta, -alpha, ply + 1)
+            game.undo_move()
+            if score > best_score:
+                best_score, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        self.ordering.cutoff(game, move, ply, depth, index, quiets_tried)
+                        break
+            if move.pieceCaptured == '-' and not move.isPawnPromotion:
+                quiets_tried.append(move)
+        if best_move is None:
+            return -CHECKMATE + ply if game.is_in_check() else 0
+
+        if best_score >= beta:
+            bound = LOWER
+        elif best_score > original_alpha:
+            bound = EXACT
+        else:
+            bound = UPPER
+        self.tt.store(key, depth, bound, score_to_tt(best_score, ply), best_move.moveID)
+        return best_score
+
+    # Only captures and promotions are searched, standing pat on the static evaluation
+    def quiescence(self, game, alpha, beta, ply):
+        stand_pat = self.evaluate(game)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        moves = game.get_valid_moves(CAPTURES | PROMOTIONS)
+        moves.sort(key=mvv_lva, reverse=True)
+        for move in moves:
+            self.nodes += 1
+            self.check_limits()
+            game.make_move(move)
+            score = -self.quiescence(game, -beta, -alpha, ply + 1)
+            game.undo_move()
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+        return alpha
@@ -0,0 +1,512 @@
+# Endgame tablebases for 3 and 4 piece material sets (KQvK, KRvK, KPvK, KQvKR, ...), built locally by
+# retrograde analysis under the engine's rules (no castling, pawns promote to a queen).
+# A table is a flat byte array on disk with one entry per position index: 0 = draw, 255 = not a legal
+# position, otherwise distance to mate in plies + 1 (odd distance: the side to move mates, even: it is mated).
+# Tables are memory mapped on first probe. En passant is not modelled, so probes with an en passant square
+# set return None, and sets with pawns on both sides (KPvKP), where a double push can always be answered en
+# passant, are neither generated nor probed.
+# Generate with: python -m Chess.Tablebase KQvK KRvK KPvK [--dir DIR]
+# Check that en passant positions are left to the search with: python -m Chess.Tablebase --check [--dir DIR]
+
+import argparse
+import mmap
+import os
+import sys
+import time
+from array import array
+from itertools import product
+
+from Chess.Bitboard import (BETWEEN, KING_ATTACKS, KNIGHT_ATTACKS, PAWN_ATTACKS, BitboardGameState, bishop_attacks,
+                            rook_attacks)
+
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tablebases')
+FILE_SUFFIX = '.tb'
+MAX_PIECES = 4
+
+DRAW = 0
+INVALID = 255
+
+PIECE_ORDER = 'KQRBNP'
+# Only used to decide which side a material set is stored from: the stronger side is always white
+PIECE_VALUES = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+
+# Generation flags per position
+DECIDED, EXIT_DRAW, WIN_PENDING = 1, 2, 4
+
+# KPvKP positions where en passant decides the result, so no table may answer for them: after d7d5 white draws
+# with exd6 and Kxd6, and loses without it; the first is the position before the push
+EN_PASSANT_CHECKS = (
+    "7K/3p4/4k3/4P3/8/8/8/8 b - - 0 1",
+    "7K/8/4k3/3pP3/8/8/8/8 w - d6 0 1",
+    "7K/8/4k3/3pP3/8/8/8/8 w - - 0 1",
+)
+
+
+# The 8 symmetries of the board as square lookup tables. Bit 2 transposes, bit 0 mirrors files, bit 1 ranks
+def _transformed(sq, symmetry):
+    row, col = divmod(sq, 8)
+    if symmetry & 4:
+        row, col = col, row
+    if symmetry & 1:
+        col = 7 - col
+    if symmetry & 2:
+        row = 7 - row
+    return row * 8 + col
+
+
+TRANSFORMS = tuple(tuple(_transformed(sq, symmetry) for sq in range(64)) for symmetry in range(8))
+
+
+# The white king is moved by a symmetry into a small region so equivalent positions share an entry.
+# Returns the region's squares and, for every square, (square tables of the symmetries that take it into the
+# region, king slot). A king on the region's diagonal has two such symmetries; the smaller index is used
+def _king_slots(symmetries, in_region):
+    squares = tuple(sq for sq in range(64) if in_region(sq))
+    slots = {sq: slot for slot, sq in enumerate(squares)}
+    choices = []
+    for sq in range(64):
+        tables = []
+        for symmetry in symmetries:
+            table = TRANSFORMS[symmetry]
+            if table[sq] in slots and table not in tables:
+                tables.append(table)
+        choices.append((tuple(tables), slots[tables[0][sq]]))
+    return squares, tuple(choices)
+
+
+# Without pawns every symmetry applies and the king goes to the a8-d8-d5 triangle; pawns only allow mirroring files
+PAWNLESS_SLOTS = _king_slots(range(8), lambda sq: sq // 8 <= sq % 8 <= 3)
+PAWN_SLOTS = _king_slots((0, 1), lambda sq: sq % 8 <= 3)
+
+
+def _strength(side):
+    return len(side), sum(PIECE_VALUES[c] for c in side), side
+
+
+# Name of a material set with each side's pieces in PIECE_ORDER and the stronger side first, e.g. KRvKP
+def table_name(white, black):
+    white = 'K' + ''.join(sorted(white.replace('K', ''), key=PIECE_ORDER.index))
+    black = 'K' + ''.join(sorted(black.replace('K', ''), key=PIECE_ORDER.index))
+    return white + 'v' + black if _strength(white) >= _strength(black) else black + 'v' + white
+
+
+# True for material sets such as KPvKP, whose tables would need en passant
+def _pawns_on_both_sides(white, black):
+    return 'P' in white and 'P' in black
+
+
+def _piece_code(colour, letter):
+    return colour + ('p' if letter == 'P' else letter)
+
+
+def _attacked(target, pieces, squares, colour, occupied):
+    for piece, sq in zip(pieces, squares):
+        if piece[0] != colour:
+            continue
+        kind = piece[1]
+        if kind == 'K':
+            hit = KING_ATTACKS[sq] >> target & 1
+        elif kind == 'N':
+            hit = KNIGHT_ATTACKS[sq] >> target & 1
+        elif kind == 'p':
+            hit = PAWN_ATTACKS[colour][sq] >> target & 1
+        else:
+            between = BETWEEN[sq][target]
+            if not between or between & occupied & ~(1 << target):
+                continue
+            orthogonal = sq // 8 == target // 8 or sq % 8 == target % 8
+            hit = kind == 'Q' or (kind == 'R') == orthogonal
+        if hit:
+            return True
+    return False
+
+
+def _targets(kind, sq, occupied):
+    if kind == 'K':
+        return KING_ATTACKS[sq]
+    if kind == 'N':
+        return KNIGHT_ATTACKS[sq]
+    if kind == 'R':
+        return rook_attacks(sq, occupied)
+    if kind == 'B':
+        return bishop_attacks(sq, occupied)
+    return rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)
+
+
+class Table:
+    def __init__(self, name):
+        white, black = name.split('v')
+        if white[:1] != 'K' or black[:1] != 'K' or not 3 <= len(white) + len(black) <= MAX_PIECES or \
+                any(c not in PIECE_ORDER for c in white + black) or table_name(white, black) != name:
+            raise ValueError("%r is not a 3 or 4 piece material set such as KQvK or KRvKP" % name)
+        if _pawns_on_both_sides(white, black):
+            raise ValueError("%s has pawns on both sides, which needs en passant; it is left to the search" % name)
+        self.name = name
+        # white's pieces then black's, kings first; a position is a square per piece
+        self.pieces = tuple(_piece_code('w', c) for c in white) + tuple(_piece_code('b', c) for c in black)
+        self.black_king = len(white)
+        self.king_squares, self.king_choices = PAWN_SLOTS if 'P' in name else PAWNLESS_SLOTS
+        self.slots = len(self.king_squares)
+        self.stride = 64 ** (len(self.pieces) - 1)
+        self.size = 2 * self.slots * self.stride
+        self.file = None
+        self.data = None
+
+    @classmethod
+    def open(cls, name, path):
+        table = cls(name)
+        table.file = open(path, 'rb')
+        table.data = mmap.mmap(table.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(table.data) != table.size:
+            table.close()
+            raise ValueError("%s holds %d entries, %s needs %d" % (path, len(table.data), name, table.size))
+        return table
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.file.close()
+            self.data = self.file = None
+
+    def index(self, squares, black_to_move):
+        tables, slot = self.king_choices[squares[0]]
+        best = None
+        for table in tables:
+            index = black_to_move * self.slots + slot
+            for sq in squares[1:]:
+                index = index * 64 + table[sq]
+            if best is None or index < best:
+                best = index
+        return best
+
+    def decode(self, index):
+        squares = []
+        for _ in range(len(self.pieces) - 1):
+            index, sq = divmod(index, 64)
+            squares.append(sq)
+        black_to_move, slot = divmod(index, self.slots)
+        squares.append(self.king_squares[slot])
+        squares.reverse()
+        return squares, black_to_move
+
+    def value(self, squares, black_to_move):
+        return self.data[self.index(squares, black_to_move)]
+
+
+class Tablebases:
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        self.tables = {}
+
+    def path(self, name):
+        return os.path.join(self.directory, name + FILE_SUFFIX)
+
+    # The memory mapped table, or None when it has not been generated
+    def get_table(self, name):
+        if name not in self.tables:
+            path = self.path(name)
+            self.tables[name] = Table.open(name, path) if os.path.exists(path) else None
+        return self.tables[name]
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = {}
+
+    # Table entry for pieces given as (piece, square) pairs, or None without a table
+    def probe_pieces(self, placed, black_to_move):
+        white = sorted((p for p in placed if p[0][0] == 'w'), key=lambda p: PIECE_ORDER.index(p[0][1].upper()))
+        black = sorted((p for p in placed if p[0][0] == 'b'), key=lambda p: PIECE_ORDER.index(p[0][1].upper()))
+        white_letters = ''.join(piece[1].upper() for piece, sq in white)
+        black_letters = ''.join(piece[1].upper() for piece, sq in black)
+        if white_letters == black_letters == 'K':
+            return DRAW
+        if _pawns_on_both_sides(white_letters, black_letters):
+            return None
+        name = table_name(white_letters, black_letters)
+        table = self.get_table(name)
+        if table is None:
+            return None
+        if name.startswith(white_letters + 'v'):
+            return table.value([sq for piece, sq in white + black], black_to_move)
+        # stored with the colours swapped: mirror the ranks and hand the move to the other side
+        return table.value([sq ^ 56 for piece, sq in black + white], not black_to_move)
+
+    # (wdl, dtm) for the side to move: wdl 1 win, 0 draw, -1 loss, dtm the plies to mate. None when the
+    # position has too many pieces, an en passant square or no generated table
+    def probe(self, game):
+        if game.enpassant_possible or 64 - sum(row.count('-') for row in game.board) > MAX_PIECES:
+            return None
+        placed = [(piece, row * 8 + col) for row, pieces in enumerate(game.board)
+                  for col, piece in enumerate(pieces) if piece != '-']
+        value = self.probe_pieces(placed, not game.whiteToMove)
+        if value is None or value == INVALID:
+            return None
+        if value == DRAW:
+            return 0, 0
+        dtm = value - 1
+        return (1 if dtm % 2 else -1), dtm
+
+    # Material sets a table's captures and promotions lead to, which must be generated first
+    @staticmethod
+    def dependencies(name):
+        white, black = name.split('v')
+        names = set()
+        for side, other, first in ((white, black, True), (black, white, False)):
+            for i in range(1, len(side)):
+                for reduced in (side[:i] + side[i + 1:], side[:i] + 'Q' + side[i + 1:] if side[i] == 'P' else None):
+                    if reduced is not None:
+                        names.add(table_name(reduced, other) if first else table_name(other, reduced))
+        names.discard('KvK')
+        return sorted(names)
+
+    # Build the table and any it depends on that are missing. log is called with progress lines
+    def generate(self, name, log=None):
+        # checked before building any dependency
+        table = Table(name)
+        for dependency in self.dependencies(name):
+            if self.get_table(dependency) is None:
+                self.generate(dependency, log)
+        start = time.perf_counter()
+        values = _Generator(table, self).run()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(name), 'wb') as file:
+            file.write(values)
+        self.tables.pop(name, None)
+        if log is not None:
+            log("%s: %d entries in %.1fs" % (name, len(values), time.perf_counter() - start))
+
+
+# Retrograde analysis of one table. Every legal position gets its count of distinct successor entries inside
+# the table; captures and promotions leave the table and are scored from the smaller tables. Mates seed the
+# search, which then walks backwards one ply at a time: a predecessor of a lost position is won, and a position
+# whose successors have all turned out won is lost. Whatever is never reached is a draw
+class _Generator:
+    def __init__(self, table, tablebases):
+        self.table = table
+        self.tablebases = tablebases
+        self.values = bytearray([INVALID]) * table.size
+        self.counts = bytearray(table.size)
+        self.longest_loss = bytearray(table.size)
+        self.flags = bytearray(table.size)
+        self.buckets = {}
+
+    def push(self, index, dtm):
+        self.buckets.setdefault(dtm, array('I')).append(index)
+
+    def run(self):
+        table = self.table
+        pieces = table.pieces
+        index = 0
+        for black_to_move in (0, 1):
+            colour, other = ('b', 'w') if black_to_move else ('w', 'b')
+            for king_sq in table.king_squares:
+                for rest in product(range(64), repeat=len(pieces) - 1):
+                    squares = (king_sq,) + rest
+                    # positions mirrored in the diagonal share the smaller entry, the other is left unused
+                    if self.is_legal(squares, colour, other) and table.index(squares, black_to_move) == index:
+                        self.values[index] = DRAW
+                        self.seed(index, list(squares), colour, other)
+                    index += 1
+
+        dtm = 0
+        while self.buckets:
+            for index in self.buckets.pop(dtm, ()):
+                if not self.flags[index] & DECIDED:
+                    self.flags[index] |= DECIDED
+                    self.values[index] = dtm + 1
+                    self.retract(index, dtm)
+            dtm += 1
+        return self.values
+
+    def is_legal(self, squares, colour, other):
+        if len(set(squares)) != len(squares):
+            return False
+        for piece, sq in zip(self.table.pieces, squares):
+            if piece[1] == 'p' and not 8 <= sq < 56:
+                return False
+        occupied = 0
+        for sq in squares:
+            occupied |= 1 << sq
+        king = squares[0] if other == 'w' else squares[self.table.black_king]
+        return not _attacked(king, self.table.pieces, squares, colour, occupied)
+
+    # Count the legal moves and score those that leave the table
+    def seed(self, index, squares, colour, other):
+        table = self.table
+        pieces = table.pieces
+        occupied = own = 0
+        for piece, sq in zip(pieces, squares):
+            occupied |= 1 << sq
+            if piece[0] == colour:
+                own |= 1 << sq
+        king_index = 0 if colour == 'w' else table.black_king
+        successors = set()
+        legal = False
+        best_win = longest_loss = 0
+        for i, piece in enumerate(pieces):
+            if piece[0] != colour:
+                continue
+            sq = squares[i]
+            for target, promotion in self.moves(piece, sq, occupied, own):
+                captured = -1
+                if (occupied & ~own) >> target & 1:
+                    captured = squares.index(target)
+                after = squares[:]
+                after[i] = target
+                after_pieces = pieces
+                if captured >= 0:
+                    after_pieces = pieces[:captured] + pieces[captured + 1:]
+                    del after[captured]
+                after_occupied = occupied & ~(1 << sq) | 1 << target
+                king = after[after_pieces.index(colour + 'K')]
+                if _attacked(king, after_pieces, after, other, after_occupied):
+                    continue
+                legal = True
+                if captured < 0 and not promotion:
+                    successors.add(table.index(after, other == 'b'))
+                    continue
+                if promotion:
+                    after_pieces = list(after_pieces)
+                    after_pieces[i - (0 <= captured < i)] = colour + 'Q'
+                value = self.tablebases.probe_pieces(list(zip(after_pieces, after)), other == 'b')
+                if value is None:
+                    raise RuntimeError("%s needs a table for %r" % (table.name, after_pieces))
+                if value == DRAW:
+                    self.flags[index] |= EXIT_DRAW
+                elif (value - 1) % 2:
+                    longest_loss = max(longest_loss, value)
+                elif not best_win or value < best_win:
+                    best_win = value
+
+        if not legal:
+            if _attacked(squares[king_index], pieces, squares, other, occupied):
+                self.push(index, 0)
+            else:
+                self.flags[index] |= DECIDED
+            return
+        self.counts[index] = len(successors)
+        self.longest_loss[index] = longest_loss
+        if best_win:
+            self.flags[index] |= WIN_PENDING
+            self.push(index, best_win)
+        elif not successors and not self.flags[index] & EXIT_DRAW:
+            self.push(index, longest_loss)
+
+    @staticmethod
+    def moves(piece, sq, occupied, own):
+        if piece[1] != 'p':
+            targets = _targets(piece[1], sq, occupied) & ~own
+            while targets:
+                target = (targets & -targets).bit_length() - 1
+                targets &= targets - 1
+                yield target, False
+            return
+        step, start_row, last_row = (-8, 6, 0) if piece[0] == 'w' else (8, 1, 7)
+        one = sq + step
+        if not occupied >> one & 1:
+            yield one, one // 8 == last_row
+            if sq // 8 == start_row and not occupied >> (one + step) & 1:
+                yield one + step, False
+        captures = PAWN_ATTACKS[piece[0]][sq] & occupied & ~own
+        while captures:
+            target = (captures & -captures).bit_length() - 1
+            captures &= captures - 1
+            yield target, target // 8 == last_row
+
+    # Squares the piece could have come from with a move that neither captured nor promoted
+    @staticmethod
+    def origins(piece, sq, occupied):
+        if piece[1] != 'p':
+            targets = _targets(piece[1], sq, occupied) & ~occupied
+            while targets:
+                origin = (targets & -targets).bit_length() - 1
+                targets &= targets - 1
+                yield origin
+            return
+        back, start_row = (8, 6) if piece[0] == 'w' else (-8, 1)
+        origin = sq + back
+        if 0 < origin // 8 < 7 and not occupied >> origin & 1:
+            yield origin
+            if origin // 8 != start_row and (origin + back) // 8 == start_row and not occupied >> (origin + back) & 1:
+                yield origin + back
+
+    # Pass the newly decided position's result back to the positions that lead to it
+    def retract(self, index, dtm):
+        table = self.table
+        pieces = table.pieces
+        squares, black_to_move = table.decode(index)
+        mover, colour = ('w', 'b') if black_to_move else ('b', 'w')
+        king = squares[0] if colour == 'w' else squares[table.black_king]
+        occupied = 0
+        for sq in squares:
+            occupied |= 1 << sq
+        predecessors = set()
+        for i, piece in enumerate(pieces):
+            if piece[0] != mover:
+                continue
+            sq = squares[i]
+            for origin in self.origins(piece, sq, occupied):
+                before = squares[:]
+                before[i] = origin
+                before_occupied = occupied & ~(1 << sq) | 1 << origin
+                # the side now to move cannot have been left in check with the other side to move
+                if not _attacked(king, pieces, before, mover, before_occupied):
+                    predecessors.add(table.index(before, mover == 'b'))
+
+        flags = self.flags
+        for previous in predecessors:
+            if flags[previous] & DECIDED:
+                continue
+            if dtm % 2 == 0:
+                self.push(previous, dtm + 1)
+                continue
+            self.counts[previous] -= 1
+            self.longest_loss[previous] = max(self.longest_loss[previous], dtm + 1)
+            if not self.counts[previous] and not flags[previous] & (WIN_PENDING | EXIT_DRAW):
+                self.push(previous, self.longest_loss[previous])
+
+
+# Probes of the EN_PASSANT_CHECKS positions must miss and KPvKP must not be generated
+def check_en_passant(tablebases, out=sys.stdout):
+    passed = True
+    for fen in EN_PASSANT_CHECKS:
+        game = BitboardGameState()
+        game.load_fen(fen)
+        entry = tablebases.probe(game)
+        passed = passed and entry is None
+        out.write("%-36s %s\n" % (fen, "ok" if entry is None else "FAIL (probed %r)" % (entry,)))
+    try:
+        Table('KPvKP')
+        refused = False
+    except ValueError:
+        refused = True
+    passed = passed and refused
+    out.write("%-36s %s\n" % ("KPvKP not generated", "ok" if refused else "FAIL"))
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate endgame tablebases by retrograde analysis.")
+    parser.add_argument("names", nargs="*", help="material sets such as KQvK KRvK KPvK KQvKR")
+    parser.add_argument("--dir", default=DEFAULT_DIRECTORY, help="where the table files are written")
+    parser.add_argument("--check", action="store_true", help="check that en passant positions are not probed")
+    args = parser.parse_args(argv)
+    if not args.names and not args.check:
+        parser.error("name at least one material set, or pass --check")
+
+    tablebases = Tablebases(args.dir)
+    if args.check:
+        passed = check_en_passant(tablebases)
+        tablebases.close()
+        return 0 if passed else 1
+    for name in args.names:
+        white, black = name.upper().split('V')
+        tablebases.generate(table_name(white, black), log=lambda line: sys.stdout.write(line + "\n"))
+    tablebases.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
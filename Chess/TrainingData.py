@@ -0,0 +1,211 @@
+# Training data for evaluation models from the games of a binary archive (Chess.Archive), as sharded .npy files.
+# Each shard is a set of memory mappable arrays with one row per position:
+#   shard-NNNNN-planes.npy  (N, 12, 8, 8) uint8  one 0/1 plane per piece in PLANE_PIECES order, row 0 = rank 8
+#   shard-NNNNN-side.npy    (N,) uint8           1 when white is to move
+#   shard-NNNNN-result.npy  (N,) int8            game result for the side to move: 1 win, 0 draw, -1 loss
+#   shard-NNNNN-eval.npy    (N,) int32           Evaluation.evaluate of the position, for the side to move
+# The export is a generator pipeline: worker processes replay batches of games through make_move and send back
+# packed positions, the main process turns each batch into arrays (BatchEvaluation, no per-position Python) and
+# copies it straight into the open shard files (np.lib.format.open_memmap). Only a few batches are in flight at
+# once, so memory stays bounded however many positions there are. Needs NumPy.
+# Run with: python -m Chess.TrainingData ARCHIVE DIRECTORY [--shard-positions N] [--workers N] [--skip-plies N]
+
+import argparse
+import os
+import sys
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from Chess.Archive import ArchiveReader, move_order, replay
+from Chess.Backends import BACKENDS
+from Chess.BatchEvaluation import evaluate_batch
+from Chess.ChessEngine import PIECE_CODE_OF
+
+PLANE_PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+PLANE_CODES = np.array([PIECE_CODE_OF[piece] for piece in PLANE_PIECES], dtype=np.int8)
+ARRAYS = {'planes': (np.uint8, (12, 8, 8)), 'side': (np.uint8, ()), 'result': (np.int8, ()), 'eval': (np.int32, ())}
+# result for white of each archived result; games without one ('*') are not exported
+WHITE_RESULTS = {'1-0': 1, '0-1': -1, '1/2-1/2': 0}
+BATCH_GAMES = 256
+SHARD_POSITIONS = 1 << 20
+PACKED_BYTES = 66
+
+
+# (packed positions, results for white) of every position of the batch's games, from the first ply kept to the end
+def _replay_batch(task):
+    path, offsets, backend, skip_plies = task
+    game = BACKENDS[backend]()
+    packed = []
+    results = array('b')
+    with ArchiveReader(path, use_index=False) as reader:
+        for offset in offsets:
+            record = reader.read(offset)[0]
+            result = WHITE_RESULTS[record.result]
+            replay(record, game, 0)
+            for ply, index in enumerate(record.moves):
+                if ply >= skip_plies:
+                    packed.append(game.get_packed_state())
+                game.make_move(sorted(game.get_valid_moves(), key=move_order)[index])
+            if len(record.moves) >= skip_plies:
+                packed.append(game.get_packed_state())
+            results.extend([result] * (len(packed) - len(results)))
+    return b''.join(packed), results.tobytes()
+
+
+# Offsets of the archive's finished games, a batch at a time
+def _batches(path, batch_games):
+    batch = []
+    with ArchiveReader(path, use_index=False) as reader:
+        for record in reader:
+            if record.result in WHITE_RESULTS:
+                batch.append(record.offset)
+                if len(batch) >= batch_games:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+
+# Yield (packed (n, 66) uint8, results for white (n,) int8) for the archive's positions, in archive order
+def position_chunks(path, workers=None, backend='bitboard', batch_games=BATCH_GAMES, skip_plies=0):
+    workers = workers or os.cpu_count() or 1
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for offsets in _batches(path, batch_games):
+            pending.append(pool.submit(_replay_batch, (path, offsets, backend, skip_plies)))
+            # enough batches queued to keep every worker busy, no more
+            if len(pending) > 2 * workers:
+                yield _unpack(*pending.popleft().result())
+        while pending:
+            yield _unpack(*pending.popleft().result())
+
+
+def _unpack(packed, results):
+    return np.frombuffer(packed, dtype=np.uint8).reshape(-1, PACKED_BYTES), np.frombuffer(results, dtype=np.int8)
+
+
+# Yield a dict of the ARRAYS for each chunk of packed positions
+def tensor_chunks(chunks):
+    for packed, white_results in chunks:
+        boards = packed[:, :64].astype(np.int8)
+        white_to_move = packed[:, 64] == 1
+        yield {
+            'planes': (boards[:, None, :] == PLANE_CODES[None, :, None]).view(np.uint8).reshape(-1, 12, 8, 8),
+            'side': white_to_move.view(np.uint8),
+            'result': np.where(white_to_move, white_results, -white_results).astype(np.int8),
+            'eval': evaluate_batch(boards, white_to_move),
+        }
+
+
+def shard_path(directory, shard, name):
+    return os.path.join(directory, "shard-%05d-%s.npy" % (shard, name))
+
+
+def _open_shard(directory, shard, positions):
+    return {name: np.lib.format.open_memmap(shard_path(directory, shard, name), mode='w+', dtype=dtype,
+                                            shape=(positions,) + shape)
+            for name, (dtype, shape) in ARRAYS.items()}
+
+
+# Copy rows start:start + take of the chunk into the shard's arrays from row filled on. A function of its own so
+# no loop variable outlives the copy holding a reference to a shard's memmap
+def _copy_rows(arrays, filled, chunk, start, take):
+    for name in arrays:
+        arrays[name][filled:filled + take] = chunk[name][start:start + take]
+
+
+# The last shard is rarely full: cut its files down to the rows written, in place. Each memmap is flushed and
+# its last reference dropped first, which unmaps it (Windows refuses to truncate a mapped file)
+def _truncate_shard(directory, shard, arrays, positions):
+    for name in ARRAYS:
+        data = arrays.pop(name)
+        data.flush()
+        del data
+        _shrink_npy(shard_path(directory, shard, name), positions)
+
+
+# Rewrite the shape in a .npy file's header to the first rows only and drop the rest of the file. The header is
+# padded to its old length, so the data does not move
+def _shrink_npy(path, rows):
+    with open(path, 'r+b') as file:
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+        # magic string, version and header length field
+        start = 8 + (2 if version == (1, 0) else 4)
+        shape = (rows,) + shape[1:]
+        header = "{'descr': %r, 'fortran_order': %r, 'shape': %r, }" % (
+            np.lib.format.dtype_to_descr(dtype), fortran_order, shape)
+        file.seek(start)
+        file.write(header.ljust(offset - start - 1).encode('latin1') + b'\n')
+        file.truncate(offset + rows * dtype.itemsize * int(np.prod(shape[1:], dtype=np.int64)))
+
+
+# Copy the chunks into shards of shard_positions rows and yield (shard path prefix, rows) as each is finished
+def write_shards(chunks, directory, shard_positions=SHARD_POSITIONS):
+    os.makedirs(directory, exist_ok=True)
+    shard, arrays, filled = 0, None, 0
+    for chunk in chunks:
+        start, count = 0, len(chunk['side'])
+        while start < count:
+            if arrays is None:
+                arrays = _open_shard(directory, shard, shard_positions)
+            take = min(count - start, shard_positions - filled)
+            _copy_rows(arrays, filled, chunk, start, take)
+            filled += take
+            start += take
+            if filled == shard_positions:
+                for name in arrays:
+                    arrays[name].flush()
+                yield shard_path(directory, shard, '*'), filled
+                shard, arrays, filled = shard + 1, None, 0
+    if arrays is not None:
+        _truncate_shard(directory, shard, arrays, filled)
+        yield shard_path(directory, shard, '*'), filled
+
+
+def export(path, directory, shard_positions=SHARD_POSITIONS, workers=None, backend='bitboard',
+           batch_games=BATCH_GAMES, skip_plies=0):
+    chunks = position_chunks(path, workers, backend, batch_games, skip_plies)
+    return write_shards(tensor_chunks(chunks), directory, shard_positions)
+
+
+# Map the arrays of one shard without reading them
+def load_shard(directory, shard):
+    return {name: np.load(shard_path(directory, shard, name), mmap_mode='r') for name in ARRAYS}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export archived games as sharded NumPy training data.")
+    parser.add_argument("archive")
+    parser.add_argument("directory")
+    parser.add_argument("--shard-positions", type=int, default=SHARD_POSITIONS)
+    parser.add_argument("--workers", type=int, help="processes replaying games (default: one per core)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="bitboard")
+    parser.add_argument("--batch-games", type=int, default=BATCH_GAMES, help="games replayed per task")
+    parser.add_argument("--skip-plies", type=int, default=0, help="leave out each game's first plies")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    positions = 0
+    written = 0
+    row_bytes = sum(np.dtype(dtype).itemsize * int(np.prod(shape, dtype=np.int64)) for dtype, shape in ARRAYS.values())
+    for shard, rows in export(args.archive, args.directory, args.shard_positions, args.workers, args.backend,
+                              args.batch_games, args.skip_plies):
+        positions += rows
+        written += rows * row_bytes
+        elapsed = time.perf_counter() - start
+        sys.stdout.write("%s  %d positions  (%d total, %.0f positions/s, %.1f MB/s)\n" % (
+            shard, rows, positions, positions / elapsed, written / elapsed / 1e6))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+# Fixed size transposition table keyed by GameState.position_key.
+# Entries live in two flat 64 bit arrays (keys and packed data), so memory is exactly 16 bytes per slot
+# whatever the node count. Each bucket holds two slots: the first keeps the deepest (or newest search's)
+# entry, the second is always replaced.
+
+from array import array
+
+# Bound types. 0 marks an empty slot
+EXACT, LOWER, UPPER = 1, 2, 3
+
+SLOT_BYTES = 16
+BUCKET_SLOTS = 2
+
+# Packed data layout: move id in bits 0-15, score + SCORE_OFFSET in 16-35, depth in 36-43,
+# bound in 44-45, search generation in 46-53
+SCORE_OFFSET = 1 << 19
+MOVE_MASK = 0xFFFF
+SCORE_MASK = (1 << 20) - 1
+BYTE_MASK = 0xFF
+
+
+class TranspositionTable:
+    def __init__(self, megabytes=16):
+        self.megabytes = megabytes
+        # largest power of two bucket count that fits the budget, so indexing is a mask
+        buckets = max(1, megabytes * 1024 * 1024 // (SLOT_BYTES * BUCKET_SLOTS))
+        self.buckets = 1 << (buckets.bit_length() - 1)
+        self.mask = self.buckets - 1
+        self.keys = array('Q', bytes(8 * self.buckets * BUCKET_SLOTS))
+        self.data = array('Q', bytes(8 * self.buckets * BUCKET_SLOTS))
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def clear(self):
+        self.keys = array('Q', bytes(8 * self.buckets * BUCKET_SLOTS))
+        self.data = array('Q', bytes(8 * self.buckets * BUCKET_SLOTS))
+        self.generation = 0
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.hits = self.misses = self.stores = self.overwrites = 0
+
+    # Called once per search so entries from earlier searches lose their claim on the depth-preferred slot
+    def new_search(self):
+        self.generation = (self.generation + 1) & BYTE_MASK
+
+    # (depth, bound, score, move id) for the position, or None
+    def probe(self, key):
+        index = (key & self.mask) * BUCKET_SLOTS
+        keys = self.keys
+        if keys[index] == key:
+            data = self.data[index]
+        elif keys[index + 1] == key:
+            data = self.data[index + 1]
+        else:
+            self.misses += 1
+            return None
+        if not data:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return (data >> 36) & BYTE_MASK, (data >> 44) & 3, ((data >> 16) & SCORE_MASK) - SCORE_OFFSET, data & MOVE_MASK
+
+    def store(self, key, depth, bound, score, move_id):
+        index = (key & self.mask) * BUCKET_SLOTS
+        keys = self.keys
+        data = self.data
+        old = data[index]
+        # depth-preferred slot: take it if it is empty, the same position, stale or no deeper than this entry
+        if not old or keys[index] == key or (old >> 46) != self.generation or ((old >> 36) & BYTE_MASK) <= depth:
+            if old and keys[index] != key:
+                self.overwrites += 1
+            if not move_id and keys[index] == key:
+                move_id = old & MOVE_MASK
+        else:
+            index += 1
+            if data[index] and keys[index] != key:
+                self.overwrites += 1
+        keys[index] = key
+        data[index] = move_id | (score + SCORE_OFFSET) << 16 | min(depth, BYTE_MASK) << 36 | bound << 44 | \
+            self.generation << 46
+        self.stores += 1
+
+    # Filled slots per thousand, sampled from the first thousand buckets (UCI hashfull)
+    def usage(self):
+        sample = min(1000, self.buckets) * BUCKET_SLOTS
+        used = sum(1 for i in range(sample) if self.data[i] and (self.data[i] >> 46) == self.generation)
+        return used * 1000 // sample
+
+    def stats(self):
+        probes = self.hits + self.misses
+        return {
+            'megabytes': self.megabytes,
+            'slots': self.buckets * BUCKET_SLOTS,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / probes if probes else 0.0,
+            'stores': self.stores,
+            'overwrites': self.overwrites,
+            'usage_permill': self.usage(),
+        }
@@ -0,0 +1,234 @@
+# Headless UCI front end for the engine. Only the engine modules are imported (no pygame), so the process
+# is ready to answer straight away. Run with: python -m Chess.UCI (or python -m Chess)
+# Searches run on a background thread so stop and isready are answered while the engine thinks.
+
+import sys
+import threading
+
+from Chess.Bitboard import BitboardGameState
+from Chess.ChessEngine import START_FEN
+from Chess.Polyglot import PolyglotBook
+from Chess.Search import CHECKMATE, Searcher, is_mate_score
+from Chess.Tablebase import Tablebases
+from Chess.TranspositionTable import TranspositionTable
+
+ENGINE_NAME = "Chess-Engine-revamped"
+ENGINE_AUTHOR = "Granted07"
+
+# Kept back from every time budget for move transmission and thread hand-over, in milliseconds
+MOVE_OVERHEAD = 20
+# upper bound of the Hash option, in megabytes
+MAX_HASH_MEGABYTES = 4096
+
+
+# Long algebraic notation as UCI wants it: e2e4, e7e8q
+def uci_move(move):
+    notation = move.get_chess_notation()[0]
+    return notation + 'q' if move.isPawnPromotion else notation
+
+
+def find_move(game, text):
+    for move in game.get_valid_moves():
+        # only queen promotions exist, so any promotion letter maps to the queen
+        if move.get_chess_notation()[0] == text[:4]:
+            return move
+    return None
+
+
+def format_score(score):
+    if is_mate_score(score):
+        plies = CHECKMATE - abs(score)
+        moves = (plies + 1) // 2
+        return "mate %d" % (moves if score > 0 else -moves)
+    return "cp %d" % score
+
+
+class UCIEngine:
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.output_lock = threading.Lock()
+        self.game = BitboardGameState()
+        self.hash_megabytes = 16
+        # created on the first go, so a large table is not allocated before the GUI's first isready
+        self.searcher = None
+        self.search_thread = None
+        # set by stop; a go infinite search holds its bestmove back until then
+        self.stop_event = threading.Event()
+        # Polyglot book consulted before searching, set with the BookFile option
+        self.book = None
+        # generated endgame tables the search probes, set with the TablebaseDir option
+        self.tablebases = None
+
+    def send(self, line):
+        with self.output_lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    # Handle one command line, False once the engine should exit
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default 16 min 1 max %d" % MAX_HASH_MEGABYTES)
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name TablebaseDir type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stop()
+            if self.searcher is not None:
+                self.searcher.tt.clear()
+                self.searcher.ordering.clear()
+            self.game = BitboardGameState()
+        elif command == "setoption":
+            self.stop()
+            self.set_option(tokens)
+        # a search still running (an infinite one in particular) is stopped, sending its bestmove, not waited for
+        elif command == "position":
+            self.stop()
+            self.position(tokens[1:])
+        elif command == "go":
+            self.stop()
+            self.go(tokens[1:])
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            if self.book is not None:
+                self.book.close()
+            return False
+        return True
+
+    def set_option(self, tokens):
+        if "name" in tokens and "value" in tokens:
+            name = " ".join(tokens[tokens.index("name") + 1:tokens.index("value")]).lower()
+            value = " ".join(tokens[tokens.index("value") + 1:])
+            if name == "hash":
+                try:
+                    self.hash_megabytes = min(MAX_HASH_MEGABYTES, max(1, int(value)))
+                except ValueError:
+                    self.send("info string invalid Hash value %s" % value)
+                    return
+                self.searcher = None
+            elif name == "bookfile":
+                if self.book is not None:
+                    self.book.close()
+                    self.book = None
+                if value and value != "<empty>":
+                    try:
+                        self.book = PolyglotBook(value)
+                    except OSError as error:
+                        self.send("info string cannot open book %s: %s" % (value, error))
+            elif name == "tablebasedir":
+                if self.tablebases is not None:
+                    self.tablebases.close()
+                self.tablebases = Tablebases(value) if value and value != "<empty>" else None
+                self.searcher = None
+
+    # A malformed FEN is reported and leaves the current position as it was
+    def position(self, tokens):
+        game = BitboardGameState()
+        if tokens and tokens[0] == "fen":
+            end = tokens.index("moves") if "moves" in tokens else len(tokens)
+            fen = " ".join(tokens[1:end])
+            try:
+                game.load_fen(fen)
+            except ValueError as error:
+                self.send("info string invalid fen %s" % error)
+                return
+        else:
+            game.load_fen(START_FEN)
+        if "moves" in tokens:
+            for text in tokens[tokens.index("moves") + 1:]:
+                move = find_move(game, text)
+                if move is None:
+                    self.send("info string illegal move " + text)
+                    break
+                game.make_move(move)
+        self.game = game
+
+    def go(self, tokens):
+        if self.book is not None and "infinite" not in tokens:
+            move = self.book.choose_move(self.game)
+            if move is not None:
+                self.send("info string book move")
+                self.send("bestmove " + uci_move(move))
+                return
+
+        limits = {}
+        for i in range(len(tokens) - 1):
+            if tokens[i] in ("depth", "movetime", "wtime", "btime", "winc", "binc", "movestogo", "nodes"):
+                # a limit that is not a number is reported and left out; the search still runs and answers
+                try:
+                    limits[tokens[i]] = int(tokens[i + 1])
+                except ValueError:
+                    self.send("info string invalid %s %s" % (tokens[i], tokens[i + 1]))
+
+        max_depth = limits.get("depth", 64)
+        node_limit = limits.get("nodes")
+        time_limit = None
+        if "movetime" in limits:
+            time_limit = max(1, limits["movetime"] - MOVE_OVERHEAD) / 1000.0
+        elif "wtime" in limits or "btime" in limits:
+            side = "w" if self.game.whiteToMove else "b"
+            remaining = limits.get(side + "time", 0)
+            increment = limits.get(side + "inc", 0)
+            moves_to_go = limits.get("movestogo", 30)
+            budget = remaining // max(1, moves_to_go) + increment * 3 // 4
+            budget = min(budget, remaining // 2) - MOVE_OVERHEAD
+            time_limit = max(1, budget) / 1000.0
+
+        if self.searcher is None:
+            self.searcher = Searcher(tt=TranspositionTable(self.hash_megabytes), tablebases=self.tablebases)
+        self.stop_event.clear()
+        self.search_thread = threading.Thread(target=self.run_search,
+                                              args=(max_depth, time_limit, node_limit, "infinite" in tokens),
+                                              daemon=True)
+        self.search_thread.start()
+
+    def run_search(self, max_depth, time_limit, node_limit, infinite=False):
+        result = self.searcher.search(self.game, max_depth=max_depth, time_limit=time_limit, node_limit=node_limit,
+                                      info=self.send_info)
+        # the protocol allows no bestmove for go infinite before stop, even once the search has nothing left to do
+        if infinite:
+            self.stop_event.wait()
+        self.send("bestmove " + (uci_move(result.move) if result.move is not None else "0000"))
+
+    def send_info(self, result):
+        elapsed_ms = int(result.elapsed * 1000)
+        nps = int(result.nodes / result.elapsed) if result.elapsed > 0 else 0
+        self.send("info depth %d score %s nodes %d nps %d time %d hashfull %d pv %s" % (
+            result.depth, format_score(result.score), result.nodes, nps, elapsed_ms, self.searcher.tt.usage(),
+            uci_move(result.move)))
+
+    def stop(self):
+        self.stop_event.set()
+        # repeated, as a stop that lands before the thread enters Searcher.search is cleared by it
+        while self.search_thread is not None and self.search_thread.is_alive():
+            self.searcher.stop()
+            self.search_thread.join(0.01)
+        self.wait_for_search()
+
+    def wait_for_search(self):
+        if self.search_thread is not None:
+            self.search_thread.join()
+            self.search_thread = None
+
+
+def main():
+    out = sys.stdout
+    # protocol output owns stdout; anything else the engine prints goes to stderr
+    sys.stdout = sys.stderr
+    engine = UCIEngine(out)
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+import os
+
+# CHESS_INSTRUMENT turns on the hot path instrumentation for the whole process, see Chess/Instrumentation.py
+if os.environ.get('CHESS_INSTRUMENT', '0') != '0':
+    from Chess import Instrumentation
+
+    Instrumentation.enable_from_environment()
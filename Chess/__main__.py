@@ -0,0 +1,4 @@
+# python -m Chess starts the headless UCI engine; the pygame board is Chess/ChessMain.py
+from Chess.UCI import main
+
+main()
@@ -2,4 +2,9 @@ HEIGHT = WIDTH = 512
 DIMENSION = 8
 SQSIZE = HEIGHT // DIMENSION
 IMAGES = dict()
-MAX_FPS = 20
\ No newline at end of file
+MAX_FPS = 20
+# Side the engine plays in ChessMain: None for two human players (the default), or 'w'/'b' to play the engine.
+# Can also be chosen per run with python ChessMain.py --engine w|b
+ENGINE_COLOUR = None
+# Seconds the engine thinks per move
+ENGINE_TIME = 1.0